@@ -1,26 +1,32 @@
 import os
+import time
+import random
+import cProfile
+import threading
+import importlib
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory, send_file, jsonify, Response, stream_with_context, g
 from flask_login import UserMixin, LoginManager, login_user, logout_user, login_required, current_user
 from dotenv import load_dotenv
-from models import User, Lab, Case, Sample, CustodyEvent, ROLE_ADMIN, ROLE_LAB, ROLE_OFFICER
-from security import LoginUser
-from utils import compute_priority, make_qr
+from werkzeug.local import LocalProxy
+from utils import compute_priority, compute_event_hash
 from werkzeug.security import generate_password_hash, check_password_hash
 import csv
-from openpyxl import load_workbook
 from io import BytesIO
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
 import secrets
-from storage import Storage
-import pandas as pd
+import click
+from scheduler import LabScheduler
+from usercache import UserCache
+from qrstore import QRStore
+from reports import ReportCache, render_case_report, export_zip
+from importer import read_rows, import_cases
+from metrics import HTTP_REQUESTS, REPORT_RENDERS, PASSWORD_HASHES, render as render_metrics
 from flask_login import login_user
 
+# pandas is only needed by the legacy sheet helpers below; load it on first use
+pd = LocalProxy(lambda: importlib.import_module('pandas'))
 
 EXCEL_FILE = 'forensic_cases.xlsx'
-xls = pd.ExcelFile(EXCEL_FILE)
-print(xls.sheet_names)
 
 load_dotenv()
 SECRET_KEY = os.getenv('SECRET_KEY', 'dev')
@@ -34,7 +40,40 @@ app.config['SECRET_KEY'] = SECRET_KEY
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
-storage = Storage('forensic_cases.xlsx')
+# Services are built on first use, so importing this module (every gunicorn
+# worker, every flask command) does not parse the workbook, talk to S3 or load
+# pandas/boto3 until a request or command actually needs storage.
+_services = {}
+_services_lock = threading.RLock()
+
+def _service(name, factory):
+    def get():
+        obj = _services.get(name)
+        if obj is None:
+            with _services_lock:
+                obj = _services.get(name)
+                if obj is None:
+                    obj = _services[name] = factory()
+        return obj
+    return LocalProxy(get)
+
+def _make_storage():
+    from storage import Storage
+    return Storage(EXCEL_FILE)
+
+storage = _service('storage', _make_storage)
+scheduler = _service('scheduler', lambda: LabScheduler(
+    storage._get_current_object(),
+    refresh_interval=float(os.getenv('SCHEDULER_REFRESH_INTERVAL','30') or 30),
+    default_capacity=int(os.getenv('LAB_DEFAULT_CAPACITY','20') or 20)))
+user_cache = _service('user_cache', lambda: UserCache(
+    storage._get_current_object(), ttl=float(os.getenv('USER_CACHE_TTL','30') or 30)))
+qr_store = QRStore(app.static_folder, workers=int(os.getenv('QR_WORKERS','2') or 0))
+
+def create_app():
+    # entry point for gunicorn ('app:create_app()') and 'flask --app app:create_app';
+    # routes are registered on the module-level app so endpoint names stay as they are
+    return app
 
 # simple user wrapper
 class WebUser(UserMixin):
@@ -59,15 +98,16 @@ class WebUser(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    u = storage.find('users', id=str(user_id))
+    u = user_cache.by_id(user_id)
     if not u:
         return None
     return WebUser(u)
 
 def bootstrap_admin():
+    # returns True when the admin account was created
     users = storage.all('users')
     if not users:
-        hashed = generate_password_hash(ADMIN_PASSWORD)
+        hashed = hash_password(ADMIN_PASSWORD)
         admin = {
             'email': ADMIN_EMAIL,
             'name': 'Admin',
@@ -76,15 +116,68 @@ def bootstrap_admin():
             'api_token': '',
         }
         storage.append('users', admin)
-bootstrap_admin()
+        return True
+    return False
+
+@app.cli.command('bootstrap-admin')
+def bootstrap_admin_cmd():
+    # one-time setup: creates ADMIN_EMAIL / ADMIN_PASSWORD when there are no users
+    if bootstrap_admin():
+        print(f"Created admin {ADMIN_EMAIL}")
+    else:
+        print("Users already exist; nothing to do")
 
+@PASSWORD_HASHES.time(op='hash')
 def hash_password(password):
     return generate_password_hash(password)
 
 # check password during login
+@PASSWORD_HASHES.time(op='verify')
 def check_password_hash_stored(stored_hash, password):
     return check_password_hash(stored_hash, password)
 
+# ---------- instrumentation ----------
+# PROFILE_SAMPLE_RATE (0..1) of requests are run under cProfile and dumped to
+# PROFILE_DIR as <endpoint>-<time>-<pid>.prof; one profile at a time per process
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE','0') or 0)
+PROFILE_DIR = os.getenv('PROFILE_DIR','') or 'profiles'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN','')
+_profile_lock = threading.Lock()
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE and _profile_lock.acquire(blocking=False):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def _observe_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        HTTP_REQUESTS.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unmatched',
+                              method=request.method, status=response.status_code)
+    return response
+
+@app.teardown_request
+def _stop_profiler(exc=None):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    try:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f"{request.endpoint or 'unmatched'}-{int(time.time() * 1000)}-{os.getpid()}.prof"))
+    finally:
+        _profile_lock.release()
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus text format; per process, so scrape each worker (or run one)
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 # ---------- UTILITIES ----------
 def read_sheet(sheet_name):
     df = pd.read_excel(EXCEL_FILE, sheet_name=sheet_name)
@@ -154,6 +247,7 @@ def read_sheet(sheet_name):
     return pd.read_excel(EXCEL_FILE, sheet_name=sheet_name)
 
 def write_sheet(df, sheet_name):
+    from openpyxl import load_workbook
     book = load_workbook(EXCEL_FILE)
     with pd.ExcelWriter(EXCEL_FILE, engine='openpyxl') as writer:
         writer.book = book
@@ -244,7 +338,7 @@ def register():
             "email": email,
             "name": email.split('@')[0],  # optional default name
             "role": "officer",  # default role
-            "password_hash": generate_password_hash(password),
+            "password_hash": hash_password(password),
             "api_token": ""
         }
         storage.append('users', new_user)
@@ -257,42 +351,12 @@ def register():
 @app.route('/')
 @login_required
 def dashboard():
-    df = pd.read_excel(EXCEL_FILE, sheet_name="cases")  # ⚠ capital C, check Excel
-
-    def priority_wrapper(status, suspect):
-        result = calculate_priority(status, suspect)
-        if isinstance(result, (list, tuple)):
-            if len(result) >= 2:
-                return (result[0], result[1])
-            elif len(result) == 1:
-                return (result[0], None)
-            else:
-                return (None, None)
-        else:
-            return (result, None)
-
-    # Build a list of tuples [(priority, label), ...]
-    priority_data = [priority_wrapper(row["Status"], row["Suspect"]) for _, row in df.iterrows()]
-    
-    # Create a DataFrame with exactly 2 columns
-    priority_df = pd.DataFrame(priority_data, columns=["Priority", "PriorityLabel"], index=df.index)
-
-    # Merge into df
-    df = pd.concat([df, priority_df], axis=1)
-
-    print(df[["Status", "Suspect", "Priority", "PriorityLabel"]].head())  # debug
-
-    df_sorted = df.sort_values(by="Priority", ascending=False)
-    cases = storage.all('cases')
-
-    def sort_key(c):
-        try:
-            return (-int(c.get('priority_score', 0)), c.get('created_at', ''))
-        except:
-            return (0, c.get('created_at', ''))
-
-    cases_sorted = sorted(cases, key=sort_key)[:200]
-    return render_template('dashboard.html', cases=cases_sorted)
+    # one page of cases, highest priority first; ?status=, ?lab= and ?cursor= narrow it
+    status = request.args.get('status') or None
+    lab = request.args.get('lab') or None
+    page = storage.query_cases(limit=200, cursor=request.args.get('cursor'), status=status, lab=lab)
+    return render_template('dashboard.html', cases=page['cases'], total=page['total'], counts=page['counts'],
+                           next_cursor=page['next_cursor'], status=status, lab=lab)
 
 
 @app.route('/admin/users', methods=['GET','POST'])
@@ -315,6 +379,15 @@ def users_list():
     users = storage.all('users')
     return render_template('users_list.html', users=users)
 
+@app.route('/admin/custody/verify')
+@login_required
+def custody_verify():
+    if not current_user.is_admin:
+        return jsonify({'error': 'forbidden'}), 403
+    full = request.args.get('full') == '1'
+    # a single request should not fork a process pool
+    return jsonify(storage.verify_custody(full=full, workers=1))
+
 @app.route("/send_to_lab/<case_id>")
 @login_required
 def send_to_lab(case_id):
@@ -342,11 +415,25 @@ def labs_list():
     if request.method == 'POST':
         name = request.form['name']
         contact = request.form.get('contact_email','')
-        storage.append('labs', {'name': name, 'contact_email': contact, 'is_active': True})
+        capacity = request.form.get('capacity','').strip() or str(scheduler.default_capacity)
+        if not capacity.isdigit() or int(capacity) < 1:
+            flash('Capacity must be a whole number of at least 1', 'danger')
+            return redirect(url_for('labs_list'))
+        storage.append('labs', {'name': name, 'contact_email': contact, 'is_active': True, 'capacity': int(capacity)})
+        scheduler.invalidate()
         flash('Lab added', 'success')
         return redirect(url_for('labs_list'))
     labs = storage.all('labs')
-    return render_template('labs_list.html', labs=labs)
+    return render_template('labs_list.html', labs=labs, load=scheduler.stats()['labs'])
+
+@app.route('/admin/labs/dispatch', methods=['POST'])
+@login_required
+def labs_dispatch():
+    if not current_user.is_admin:
+        return jsonify({'error':'forbidden'}), 403
+    limit = request.args.get('limit', type=int)
+    assigned = scheduler.dispatch(limit=limit)
+    return jsonify({'assigned': [{'case_number': cn, 'lab': lab} for cn, lab in assigned]})
 
 @app.route('/cases/new', methods=['GET','POST'])
 @login_required
@@ -357,46 +444,100 @@ def case_new():
         description = request.form.get('description','')
         in_custody = request.form.get('suspect_in_custody') == 'on'
         priority = compute_priority(offence_type, age_days=0, suspect_in_custody=in_custody)
-        c = {'case_number': case_number, 'offence_type': offence_type, 'description': description, 'priority_score': priority, 'status': 'created', 'created_by': current_user.email}
-        new_case = storage.append('cases', c)
-        # create default sample
-        code = f"S-{new_case['id']:06d}-A"
-        qr_path = make_qr(code)
-        s = {'case_number': case_number, 'code': code, 'qr_path': qr_path, 'status': 'sealed'}
-        storage.append('samples', s)
-        # custody event
-        prev_hash = storage.last_event_hash(case_number)
-        payload = {'actor': current_user.email, 'action': 'created_case', 'sample_code': code, 'timestamp': datetime.utcnow().isoformat()}
-        h = compute_event_hash(prev_hash, payload)
-        ev = {'case_number': case_number, 'sample_code': code, 'actor': current_user.email, 'action': 'created_case', 'timestamp': datetime.utcnow().isoformat(), 'note': 'Case and sample created', 'prev_hash': prev_hash, 'hash': h}
-        storage.append('custody_events', ev)
+        c = {'case_number': case_number, 'offence_type': offence_type, 'description': description, 'priority_score': priority, 'status': 'created', 'created_by': current_user.email, 'suspect_in_custody': int(in_custody)}
+        with storage.transaction('cases', 'samples', 'custody_events') as tx:
+            new_case = tx.append('cases', c)
+            # create default sample
+            code = f"S-{new_case['id']:06d}-A"
+            qr_path = qr_store.submit(code)
+            s = {'case_number': case_number, 'code': code, 'qr_path': qr_path, 'status': 'sealed'}
+            tx.append('samples', s)
+            # custody event
+            prev_hash = tx.last_event_hash(case_number)
+            ts = datetime.utcnow().isoformat()
+            payload = {'actor': current_user.email, 'action': 'created_case', 'sample_code': code, 'timestamp': ts}
+            h = compute_event_hash(prev_hash, payload)
+            ev = {'case_number': case_number, 'sample_code': code, 'actor': current_user.email, 'action': 'created_case', 'timestamp': ts, 'note': 'Case and sample created', 'prev_hash': prev_hash, 'hash': h}
+            tx.append('custody_events', ev)
+        scheduler.add(new_case)
         flash('Case created', 'success')
         return redirect(url_for('case_detail', case_number=case_number))
     return render_template('case_new.html')
 
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE','1000') or 1000)
+
+@app.route('/admin/cases/import', methods=['POST'])
+@login_required
+def cases_import():
+    # multipart 'file' (.csv or .xlsx) with a case_number column and optional
+    # offence_type, description, suspect_in_custody, created_at columns
+    if not current_user.is_admin:
+        return jsonify({'error':'forbidden'}), 403
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error':'no file'}), 400
+    result = import_cases(storage, qr_store, read_rows(upload.stream, upload.filename), current_user.email,
+                          chunk_size=IMPORT_CHUNK_SIZE)
+    scheduler.invalidate()
+    return jsonify(result)
+
+QR_PLACEHOLDER = ('<svg xmlns="http://www.w3.org/2000/svg" width="290" height="290" viewBox="0 0 290 290">'
+                  '<rect width="290" height="290" fill="#f1f3f5"/><text x="145" y="150" font-family="sans-serif" '
+                  'font-size="16" text-anchor="middle" fill="#868e96">QR code pending</text></svg>')
+
+@app.context_processor
+def qr_helpers():
+    def qr_url(qr_path):
+        # content-addressed labels go through qr_image, older rows are plain static files
+        name = os.path.splitext(os.path.basename(str(qr_path)))[0]
+        if qr_store.is_digest(name):
+            return url_for('qr_image', digest=name)
+        return url_for('static', filename=qr_path)
+    return {'qr_url': qr_url}
+
+@app.route('/qr/<digest>.png')
+def qr_image(digest):
+    if not qr_store.is_digest(digest):
+        return jsonify({'error':'not found'}), 404
+    if not qr_store.ready(digest):
+        # not rendered yet (or lost with a restarted worker): queue it again
+        s = storage.find('samples', qr_path=os.path.join('qrcodes', f"{digest}.png"))
+        if s is None:
+            return jsonify({'error':'not found'}), 404
+        qr_store.submit(s['code'])
+        resp = Response(QR_PLACEHOLDER, mimetype='image/svg+xml')
+        resp.headers['Cache-Control'] = 'no-store'
+        resp.headers['Retry-After'] = '1'
+        return resp
+    # the file name is the hash of its content, so it can be cached forever
+    resp = send_file(qr_store.path(digest), mimetype='image/png', etag=False, conditional=False, max_age=31536000)
+    resp.set_etag(digest)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp.make_conditional(request)
+
 @app.route('/cases/<case_number>')
 @login_required
 def case_detail(case_number):
-    case = storage.find('cases', case_number=case_number)
-    if not case:
+    bundle = storage.get_case_bundle(case_number)
+    if not bundle:
         flash('Case not found', 'danger')
         return redirect(url_for('dashboard'))
-    samples = storage.filter('samples', case_number=case_number)
-    events = storage.filter('custody_events', case_number=case_number)
-    events_sorted = sorted(events, key=lambda e: e.get('timestamp',''))
-    return render_template('case_detail.html', case=case, samples=samples, events=events_sorted)
+    return render_template('case_detail.html', case=bundle['case'], samples=bundle['samples'], events=bundle['events'])
 
 @app.route('/cases/<case_number>/status', methods=['POST'])
 @login_required
 def case_status(case_number):
     new_status = request.form['status']
-    storage.update('cases', 'case_number', case_number, {'status': new_status})
-    # log event
-    prev_hash = storage.last_event_hash(case_number)
-    payload = {'actor': current_user.email, 'action': f'status:{new_status}', 'timestamp': datetime.utcnow().isoformat()}
-    h = compute_event_hash(prev_hash, payload)
-    ev = {'case_number': case_number, 'sample_code': '', 'actor': current_user.email, 'action': f'status:{new_status}', 'timestamp': datetime.utcnow().isoformat(), 'note': '', 'prev_hash': prev_hash, 'hash': h}
-    storage.append('custody_events', ev)
+    with storage.transaction('cases', 'custody_events') as tx:
+        tx.update('cases', 'case_number', case_number, {'status': new_status})
+        # log event
+        prev_hash = tx.last_event_hash(case_number)
+        ts = datetime.utcnow().isoformat()
+        payload = {'actor': current_user.email, 'action': f'status:{new_status}', 'timestamp': ts}
+        h = compute_event_hash(prev_hash, payload)
+        ev = {'case_number': case_number, 'sample_code': '', 'actor': current_user.email, 'action': f'status:{new_status}', 'timestamp': ts, 'note': '', 'prev_hash': prev_hash, 'hash': h}
+        tx.append('custody_events', ev)
     flash('Status updated', 'success')
     return redirect(url_for('case_detail', case_number=case_number))
 
@@ -404,7 +545,7 @@ def case_status(case_number):
 def authorize_api(token):
     if not token:
         return None
-    u = storage.find('users', api_token=token)
+    u = user_cache.by_token(token)
     if not u or u.get('role')!='lab':
         return None
     return u
@@ -492,15 +633,18 @@ def api_receive(case_number):
     user = authorize_api(token)
     if not user:
         return jsonify({'error':'unauthorized'}), 401
-    c = storage.find('cases', case_number=case_number)
-    if not c:
-        return jsonify({'error':'not found'}), 404
-    storage.update('cases', 'case_number', case_number, {'status': 'in_lab', 'lab_assigned': user.get('email')})
-    prev_hash = storage.last_event_hash(case_number)
-    payload = {'actor': user.get('email'), 'action': 'received_by_lab', 'timestamp': datetime.utcnow().isoformat()}
-    h = compute_event_hash(prev_hash, payload)
-    ev = {'case_number': case_number, 'sample_code': '', 'actor': user.get('email'), 'action': 'received_by_lab', 'timestamp': datetime.utcnow().isoformat(), 'note': 'Received via API', 'prev_hash': prev_hash, 'hash': h}
-    storage.append('custody_events', ev)
+    with storage.transaction('cases', 'custody_events') as tx:
+        c = tx.find('cases', case_number=case_number)
+        if not c:
+            return jsonify({'error':'not found'}), 404
+        tx.update('cases', 'case_number', case_number, {'status': 'in_lab', 'lab_assigned': user.get('email')})
+        prev_hash = tx.last_event_hash(case_number)
+        ts = datetime.utcnow().isoformat()
+        payload = {'actor': user.get('email'), 'action': 'received_by_lab', 'timestamp': ts}
+        h = compute_event_hash(prev_hash, payload)
+        ev = {'case_number': case_number, 'sample_code': '', 'actor': user.get('email'), 'action': 'received_by_lab', 'timestamp': ts, 'note': 'Received via API', 'prev_hash': prev_hash, 'hash': h}
+        tx.append('custody_events', ev)
+    scheduler.invalidate()
     return jsonify({'ok': True})
 
 @app.route('/api/v1/cases/<case_number>/complete', methods=['POST'])
@@ -509,68 +653,245 @@ def api_complete(case_number):
     user = authorize_api(token)
     if not user:
         return jsonify({'error':'unauthorized'}), 401
-    c = storage.find('cases', case_number=case_number)
-    if not c:
-        return jsonify({'error':'not found'}), 404
     # store a simple result summary if provided
     result_summary = request.json.get('result_summary') if request.is_json else request.form.get('result_summary','')
-    storage.update('cases', 'case_number', case_number, {'status': 'completed'})
-    # append lab_result
-    storage.append('lab_results', {'case_number': case_number, 'sample_code': '', 'lab_user': user.get('email'), 'result_summary': result_summary, 'result_file': ''})
-    prev_hash = storage.last_event_hash(case_number)
-    payload = {'actor': user.get('email'), 'action': 'completed_by_lab', 'timestamp': datetime.utcnow().isoformat()}
-    h = compute_event_hash(prev_hash, payload)
-    ev = {'case_number': case_number, 'sample_code': '', 'actor': user.get('email'), 'action': 'completed_by_lab', 'timestamp': datetime.utcnow().isoformat(), 'note': 'Completed via API', 'prev_hash': prev_hash, 'hash': h}
-    storage.append('custody_events', ev)
+    with storage.transaction('cases', 'lab_results', 'custody_events') as tx:
+        c = tx.find('cases', case_number=case_number)
+        if not c:
+            return jsonify({'error':'not found'}), 404
+        tx.update('cases', 'case_number', case_number, {'status': 'completed'})
+        # append lab_result
+        tx.append('lab_results', {'case_number': case_number, 'sample_code': '', 'lab_user': user.get('email'), 'result_summary': result_summary, 'result_file': ''})
+        prev_hash = tx.last_event_hash(case_number)
+        ts = datetime.utcnow().isoformat()
+        payload = {'actor': user.get('email'), 'action': 'completed_by_lab', 'timestamp': ts}
+        h = compute_event_hash(prev_hash, payload)
+        ev = {'case_number': case_number, 'sample_code': '', 'actor': user.get('email'), 'action': 'completed_by_lab', 'timestamp': ts, 'note': 'Completed via API', 'prev_hash': prev_hash, 'hash': h}
+        tx.append('custody_events', ev)
+    scheduler.invalidate()
     return jsonify({'ok': True})
 
+API_BATCH_LIMIT = int(os.getenv('API_BATCH_LIMIT','500') or 500)
+
+def _batch_items(key):
+    body = request.get_json(silent=True)
+    items = body.get(key) if isinstance(body, dict) else None
+    return items if isinstance(items, list) else None
+
+def _apply_batch(user, items, action, note, updates, lab_results=False):
+    # one transaction for the whole batch: every item is checked first, then the
+    # case updates, lab results and custody events are each written in one go.
+    # Returns a per-item status list in request order
+    actor = user.get('email')
+    results, accepted, seen = [], [], set()
+    with storage.transaction('cases', 'lab_results', 'custody_events') as tx:
+        # only the submitted case numbers are looked up, not the whole table
+        submitted = [str(item.get('case_number', '') or '').strip() for item in items if isinstance(item, dict)]
+        known = tx.find_many('cases', 'case_number', [cn for cn in submitted if cn])
+        for item in items:
+            case_number = str(item.get('case_number', '') or '').strip() if isinstance(item, dict) else ''
+            if not case_number:
+                results.append({'case_number': None, 'status': 'invalid'})
+            elif case_number in seen:
+                results.append({'case_number': case_number, 'status': 'duplicate'})
+            elif case_number not in known:
+                results.append({'case_number': case_number, 'status': 'not_found'})
+            else:
+                seen.add(case_number)
+                accepted.append((case_number, item))
+                results.append({'case_number': case_number, 'status': 'ok'})
+        if not accepted:
+            return results
+        ts = datetime.utcnow().isoformat()
+        # one chain index lookup for the batch; each case appears once, so its
+        # event chains straight onto the head read here
+        heads = tx.last_event_hashes([cn for cn, _ in accepted])
+        events = []
+        for case_number, item in accepted:
+            prev_hash = heads[case_number]
+            payload = {'actor': actor, 'action': action, 'timestamp': ts}
+            h = compute_event_hash(prev_hash, payload)
+            events.append({'case_number': case_number, 'sample_code': '', 'actor': actor, 'action': action, 'timestamp': ts, 'note': note, 'prev_hash': prev_hash, 'hash': h})
+        tx.bulk_update('cases', 'case_number', [dict(updates, case_number=cn) for cn, _ in accepted])
+        if lab_results:
+            tx.append_many('lab_results', [{'case_number': cn, 'sample_code': '', 'lab_user': actor, 'result_summary': str(item.get('result_summary', '') or ''), 'result_file': ''} for cn, item in accepted])
+        tx.append_many('custody_events', events)
+    scheduler.invalidate()
+    return results
+
+def _batch_response(results):
+    accepted = sum(1 for r in results if r['status'] == 'ok')
+    return jsonify({'ok': accepted == len(results), 'accepted': accepted, 'results': results})
+
+@app.route('/api/v1/cases/batch/receive', methods=['POST'])
+def api_batch_receive():
+    # {"case_numbers": ["CN1", ...]}
+    user = authorize_api(request.headers.get('X-API-Token'))
+    if not user:
+        return jsonify({'error':'unauthorized'}), 401
+    case_numbers = _batch_items('case_numbers')
+    if case_numbers is None:
+        return jsonify({'error':'expected {"case_numbers": [...]}'}), 400
+    if len(case_numbers) > API_BATCH_LIMIT:
+        return jsonify({'error':f'at most {API_BATCH_LIMIT} items per batch'}), 413
+    items = [{'case_number': cn} if isinstance(cn, str) else None for cn in case_numbers]
+    results = _apply_batch(user, items, 'received_by_lab', 'Received via API',
+                           {'status': 'in_lab', 'lab_assigned': user.get('email')})
+    return _batch_response(results)
+
+@app.route('/api/v1/cases/batch/complete', methods=['POST'])
+def api_batch_complete():
+    # {"results": [{"case_number": "CN1", "result_summary": "..."}, ...]}
+    user = authorize_api(request.headers.get('X-API-Token'))
+    if not user:
+        return jsonify({'error':'unauthorized'}), 401
+    items = _batch_items('results')
+    if items is None:
+        return jsonify({'error':'expected {"results": [...]}'}), 400
+    if len(items) > API_BATCH_LIMIT:
+        return jsonify({'error':f'at most {API_BATCH_LIMIT} items per batch'}), 413
+    results = _apply_batch(user, items, 'completed_by_lab', 'Completed via API',
+                           {'status': 'completed'}, lab_results=True)
+    return _batch_response(results)
+
+@app.route('/api/v1/labs/next-case', methods=['GET','POST'])
+def api_next_case():
+    # highest-priority case queued for the caller's lab (labs.contact_email).
+    # GET only reads the lab's queue; POST also claims an unassigned case for
+    # the lab when its queue is empty
+    user = authorize_api(request.headers.get('X-API-Token'))
+    if not user:
+        return jsonify({'error':'unauthorized'}), 401
+    c = scheduler.next_case(user.get('email'), claim=request.method == 'POST')
+    if c is None:
+        return jsonify({'case': None})
+    return jsonify({'case': {k: c.get(k) for k in ('case_number', 'offence_type', 'priority_score', 'status', 'created_at', 'lab_assigned')}})
+
+@app.cli.command('compact-journal')
+def compact_journal():
+    n = storage.compact()
+    print(f"Compacted {n} journaled table(s) into {storage.xlsx_path}")
+
+@app.cli.command('rebuild-chain-index')
+def rebuild_chain_index():
+    n = storage.rebuild_chain_index()
+    print(f"Indexed custody chain heads for {n} case(s)")
+
+@app.cli.command('rescore-priorities')
+def rescore_priorities():
+    n = storage.rescore_cases()
+    print(f"Re-scored {n} open case(s)")
+
+@app.cli.command('dispatch-cases')
+@click.option('--limit', type=int, default=None)
+def dispatch_cases(limit):
+    for case_number, lab in scheduler.dispatch(limit=limit):
+        print(f"{case_number} -> {lab}")
+
+@app.cli.command('prerender-qr')
+def prerender_qr():
+    # draw every sample label that is missing on disk, in parallel
+    samples = storage.all('samples')
+    paths = qr_store.render_many([s['code'] for s in samples if s.get('code')])
+    print(f"{len(paths)} QR label(s) ready")
+
+@app.cli.command('import-cases')
+@click.argument('path')
+@click.option('--actor', default=None, help='recorded as created_by and custody actor (default: ADMIN_EMAIL)')
+@click.option('--chunk-size', type=int, default=None)
+def import_cases_cmd(path, actor, chunk_size):
+    started = time.perf_counter()
+    result = import_cases(storage, qr_store, read_rows(path), actor or ADMIN_EMAIL,
+                          chunk_size=chunk_size or IMPORT_CHUNK_SIZE)
+    print(f"Imported {result['created']} case(s) in {result['chunks']} chunk(s), "
+          f"{result['error_count']} row(s) rejected, {time.perf_counter() - started:.1f}s")
+    for e in result['errors'][:50]:
+        print(f"  line {e['line']} {e['case_number']}: {e['error']}")
+
+@app.cli.command('verify-custody')
+@click.option('--full', is_flag=True, help='ignore the checkpoint and re-hash every event')
+@click.option('--workers', type=int, default=None, help='process pool size (default: CPU count)')
+def verify_custody_cmd(full, workers):
+    report = storage.verify_custody(full=full, workers=workers)
+    print(f"{report['cases']} case(s), {report['events']} event(s): "
+          f"{report['verified_events']} verified, {report['skipped_events']} covered by checkpoint ({report['checkpoint']})")
+    for f in report['failures']:
+        print(f"  FAIL {f['case_number']} event {f['event_id']}: {f['reason']}")
+    if not report['ok']:
+        raise SystemExit(1)
+
+@app.cli.command('split-workbook')
+@click.argument('workbook', required=False)
+def split_workbook(workbook):
+    # run with S3_LAYOUT=tables; without a path the S3 workbook object is split
+    counts = storage.split_workbook(workbook)
+    for table, n in counts.items():
+        print(f"{table}: {n} rows")
+
+@app.route('/api/v1/cases/<case_number>/proof')
+def api_proof(case_number):
+    # lab API token or a logged-in session; pass event_id, sample_code or hash
+    user = authorize_api(request.headers.get('X-API-Token'))
+    if not user and not current_user.is_authenticated:
+        return jsonify({'error':'unauthorized'}), 401
+    args = request.args
+    if not (args.get('event_id') or args.get('sample_code') or args.get('hash')):
+        return jsonify({'error':'event_id, sample_code or hash required'}), 400
+    proof = storage.custody_proof(case_number, event_id=args.get('event_id'),
+                                  sample_code=args.get('sample_code'), event_hash=args.get('hash'))
+    if not proof:
+        return jsonify({'error':'not found'}), 404
+    proof['algorithm'] = 'sha256; leaf=H(0x00||event_hash), node=H(0x01||left||right)'
+    return jsonify(proof)
+
 # PDF report generator
+REPORT_EXPORT_LIMIT = int(os.getenv('REPORT_EXPORT_LIMIT','500') or 500)
+report_cache = _service('report_cache', lambda: ReportCache(
+    os.getenv('REPORT_CACHE_DIR','') or os.path.join(storage.data_dir, 'report_cache')))
+
+def _report_key(case_number, bundle):
+    # from the bundle the PDF is rendered from, so an event landing meanwhile
+    # can't file an older report under the newer head
+    events = bundle['events']
+    return ReportCache.key(case_number, events[-1].get('hash', '') if events else '', len(bundle['results']))
+
 @app.route('/cases/<case_number>/report')
 @login_required
 def case_report(case_number):
-    case = storage.find('cases', case_number=case_number)
-    if not case:
+    bundle = storage.get_case_bundle(case_number)
+    if not bundle:
         flash('Case not found', 'danger')
         return redirect(url_for('dashboard'))
-    events = storage.filter('custody_events', case_number=case_number)
-    results = storage.filter('lab_results', case_number=case_number)
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(40, height - 40, f"DNA FastTrack — Case Report: {case_number}")
-    c.setFont("Helvetica", 10)
-    c.drawString(40, height - 60, f"Offence: {case.get('offence_type','')}")
-    c.drawString(40, height - 75, f"Status: {case.get('status','')}")
-    c.drawString(40, height - 90, f"Created: {case.get('created_at','')}")
-    y = height - 120
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(40, y, "Chain of Custody:")
-    y -= 16
-    c.setFont("Helvetica", 9)
-    for ev in sorted(events, key=lambda e: e.get('timestamp','')):
-        line = f"{ev.get('timestamp','')} — {ev.get('actor','')} — {ev.get('action','')} — {ev.get('note','')}"
-        c.drawString(40, y, line[:120])
-        y -= 12
-        if y < 80:
-            c.showPage()
-            y = height - 40
-    if results:
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(40, y-10, "Lab Results:")
-        y -= 26
-        c.setFont("Helvetica", 9)
-        for r in results:
-            line = f"{r.get('created_at','')} — {r.get('lab_user','')} — {r.get('result_summary','')}"
-            c.drawString(40, y, line[:120])
-            y -= 12
-            if y < 80:
-                c.showPage()
-                y = height - 40
-    c.showPage()
-    c.save()
-    buffer.seek(0)
-    return send_file(buffer, mimetype='application/pdf', download_name=f"{case_number}_report.pdf", as_attachment=True)
+    results = bundle['results']
+    key = _report_key(case_number, bundle)
+    pdf = report_cache.get(case_number, key)
+    if pdf is None:
+        with REPORT_RENDERS.time():
+            pdf = render_case_report(case_number, bundle['case'], bundle['events'], results)
+        report_cache.put(case_number, key, pdf)
+    return send_file(BytesIO(pdf), mimetype='application/pdf', download_name=f"{case_number}_report.pdf", as_attachment=True)
+
+@app.route('/reports/export.zip')
+@login_required
+def reports_export():
+    # ?case_number=CN1&case_number=CN2..., or the first ?limit=N dashboard cases (?status=, ?lab=)
+    case_numbers = request.args.getlist('case_number')
+    if not case_numbers:
+        limit = request.args.get('limit', 50, type=int)
+        page = storage.query_cases(limit=max(1, min(limit, REPORT_EXPORT_LIMIT)),
+                                   status=request.args.get('status') or None, lab=request.args.get('lab') or None)
+        case_numbers = [str(c['case_number']) for c in page['cases']]
+    if len(case_numbers) > REPORT_EXPORT_LIMIT:
+        return jsonify({'error': f'at most {REPORT_EXPORT_LIMIT} cases per export'}), 413
+    # indexed lookups per case instead of converting whole tables
+    jobs = []
+    for cn in dict.fromkeys(case_numbers):
+        bundle = storage.get_case_bundle(cn)
+        if bundle:
+            jobs.append((cn, _report_key(cn, bundle), bundle['case'], bundle['events'], bundle['results']))
+    workers = int(os.getenv('REPORT_WORKERS','0') or 0) or None
+    return Response(stream_with_context(export_zip(jobs, report_cache, workers=workers)), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=case_reports.zip'})
 
 @app.route("/generate_report/<case_id>")
 @login_required
@@ -582,6 +903,7 @@ def generate_report(case_id):
         return redirect(url_for("dashboard"))
     case = case[0]
 
+    from reportlab.pdfgen import canvas
     pdf_file = BytesIO()
     c = canvas.Canvas(pdf_file)
     c.drawString(100, 750, f"Case Report: {case['CaseID']}")
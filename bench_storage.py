@@ -0,0 +1,282 @@
+# bench_storage.py  (Storage benchmark: synthetic data, every backend, JSON results)
+#
+#   python bench_storage.py [--sizes 1000,10000,100000] [--backends excel,csv,...]
+#                           [--repeat 20] [--budget 30] [--out results.json]
+#                           [--compare baseline.json]
+#
+# Each backend gets a fresh temp dir seeded with `size` cases, samples and
+# custody events (users: size/100). Every operation runs up to --repeat times or
+# until --budget seconds are spent on it, then once more under tracemalloc for
+# its peak allocation. The *+s3 backends need moto: with "moto[server]" they talk
+# HTTP to a local S3 endpoint, with plain moto to its in-process mock, and without
+# moto they are skipped. --compare prints p50 ratios against an earlier run.
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from storage import Storage, TABLES
+from utils import compute_event_hash, OFFENCE_WEIGHTS
+
+# storage settings per backend; every key in ENV_KEYS is set (or cleared) for each run
+BACKENDS = {
+    'excel': {'STORAGE_BACKEND': 'excel'},
+    'excel+journal': {'STORAGE_BACKEND': 'excel', 'JOURNAL_ENABLED': '1'},
+    'csv': {'STORAGE_BACKEND': 'csv'},
+    'parquet': {'STORAGE_BACKEND': 'parquet'},
+    'sqlite': {'STORAGE_BACKEND': 'sqlite'},
+    'excel+s3': {'STORAGE_BACKEND': 'excel', 'S3_ENABLED': '1'},
+    'parquet+s3': {'STORAGE_BACKEND': 'parquet', 'S3_ENABLED': '1', 'S3_LAYOUT': 'tables'},
+}
+ENV_KEYS = ('STORAGE_BACKEND', 'JOURNAL_ENABLED', 'JOURNAL_COMPACT_INTERVAL', 'S3_ENABLED', 'S3_LAYOUT',
+            'S3_BUCKET', 'S3_ENDPOINT_URL', 'S3_REFRESH_INTERVAL', 'S3_UPLOAD_ASYNC', 'SQLITE_PATH',
+            'PRIORITY_RESCORE_INTERVAL', 'AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY')
+S3_BUCKET = 'fasttrack-bench'
+
+
+@contextmanager
+def patched_env(values):
+    saved = {k: os.environ.get(k) for k in ENV_KEYS}
+    try:
+        for k in ENV_KEYS:
+            os.environ.pop(k, None)
+        os.environ.update(values)
+        yield
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+# ---------- synthetic data ----------
+
+def synthetic_tables(size, seed=7):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    offences = list(OFFENCE_WEIGHTS)
+    n_users = max(10, size // 100)
+    users = [{'id': i + 1, 'email': f'user{i}@bench.local', 'name': f'User {i}',
+              'role': rng.choice(['officer', 'lab', 'admin']), 'password_hash': 'x',
+              'api_token': f'tok{i}', 'created_at': start.isoformat()} for i in range(n_users)]
+    cases, samples, events = [], [], []
+    heads = {}
+    for i in range(size):
+        cn = f'BENCH-{i:07d}'
+        created = (start + timedelta(minutes=i)).isoformat()
+        cases.append({'id': i + 1, 'case_number': cn, 'offence_type': rng.choice(offences), 'description': '',
+                      'priority_score': rng.choice([20, 40, 60, 80, 100]),
+                      'status': rng.choice(['created', 'in_lab', 'completed']), 'created_at': created,
+                      'created_by': users[i % n_users]['email'], 'lab_assigned': '', 'suspect_in_custody': i % 2})
+        samples.append({'id': i + 1, 'case_number': cn, 'code': f'S-{i + 1:06d}-A', 'qr_path': '',
+                        'status': 'sealed', 'created_at': created})
+    # as many events as cases, spread over a tenth of them so chains have some length
+    chains = max(1, size // 10)
+    for i in range(size):
+        cn = f'BENCH-{rng.randrange(chains):07d}'
+        ts = (start + timedelta(seconds=i)).isoformat()
+        prev = heads.get(cn, '')
+        payload = {'actor': 'bench', 'action': 'note', 'timestamp': ts}
+        h = compute_event_hash(prev, payload)
+        heads[cn] = h
+        events.append({'id': i + 1, 'case_number': cn, 'sample_code': '', 'actor': 'bench', 'action': 'note',
+                       'timestamp': ts, 'note': '', 'prev_hash': prev, 'hash': h})
+    frames = {'users': users, 'labs': [], 'cases': cases, 'samples': samples,
+              'custody_events': events, 'lab_results': []}
+    return {t: pd.DataFrame(rows, columns=TABLES[t] if not rows else None) for t, rows in frames.items()}
+
+
+def seed(storage, frames):
+    if storage.sql is not None:
+        for table, df in frames.items():
+            storage.sql.replace_frame(table, df)
+    else:
+        storage._write_tables(frames)
+        storage.flush_uploads()
+    storage.rebuild_chain_index()
+
+
+# ---------- local S3 ----------
+
+@contextmanager
+def local_s3():
+    # moto's threaded server gives boto3 a real HTTP endpoint; without its server
+    # extras the in-process mock is used instead. Yields the env to use, or None
+    creds = {'AWS_ACCESS_KEY_ID': 'bench', 'AWS_SECRET_ACCESS_KEY': 'bench'}
+    try:
+        import boto3
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        ThreadedMotoServer = None
+    if ThreadedMotoServer is not None:
+        server = ThreadedMotoServer(ip_address='127.0.0.1', port=0)
+        server.start()
+        host, port = server.get_host_and_port()
+        endpoint = f'http://{host}:{port}'
+        boto3.client('s3', endpoint_url=endpoint, region_name='us-east-1',
+                     aws_access_key_id='bench', aws_secret_access_key='bench').create_bucket(Bucket=S3_BUCKET)
+        try:
+            yield dict(creds, S3_BUCKET=S3_BUCKET, S3_ENDPOINT_URL=endpoint)
+        finally:
+            server.stop()
+        return
+    try:
+        from moto import mock_aws
+    except ImportError:
+        print("moto not installed: skipping the S3 backends", file=sys.stderr)
+        yield None
+        return
+    print("moto server extras missing: using the in-process S3 mock", file=sys.stderr)
+    with patched_env(creds), mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=S3_BUCKET)
+        yield dict(creds, S3_BUCKET=S3_BUCKET)
+
+
+# ---------- measurement ----------
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def measure(fn, repeat, budget):
+    samples = []
+    started = time.perf_counter()
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - t0)
+        if time.perf_counter() - started > budget:
+            break
+    tracemalloc.start()
+    try:
+        fn(len(samples))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    ms = [s * 1000 for s in samples]
+    return {'n': len(ms), 'p50_ms': round(_percentile(ms, 50), 3), 'p95_ms': round(_percentile(ms, 95), 3),
+            'mean_ms': round(sum(ms) / len(ms), 3), 'peak_mem_kb': round(peak / 1024, 1)}
+
+
+def operations(storage, size, seed=11):
+    rng = random.Random(seed)
+    chains = max(1, size // 10)
+    case = lambda: f'BENCH-{rng.randrange(size):07d}'
+    chained = lambda: f'BENCH-{rng.randrange(chains):07d}'
+    return {
+        'append': lambda i: storage.append('cases', {'case_number': f'NEW-{i:07d}', 'offence_type': 'other',
+                                                     'priority_score': 20, 'status': 'created'}),
+        'find': lambda i: storage.find('cases', case_number=case()),
+        'filter': lambda i: storage.filter('custody_events', case_number=chained()),
+        'update': lambda i: storage.update('cases', 'case_number', case(), {'status': 'in_lab'}),
+        'last_event_hash': lambda i: storage.last_event_hash(chained()),
+        'query_cases': lambda i: storage.query_cases(limit=200),
+    }
+
+
+def run_backend(name, size, frames, repeat, budget, s3_env):
+    env = dict(BACKENDS[name], S3_UPLOAD_ASYNC='1', S3_REFRESH_INTERVAL='0')
+    if env.get('S3_ENABLED') == '1':
+        if s3_env is None:
+            return None
+        env.update(s3_env, S3_WORKBOOK_KEY=f'bench/{name}/{size}.xlsx', S3_TABLE_PREFIX=f'bench/{name}/{size}/')
+    workdir = tempfile.mkdtemp(prefix=f'bench-{name}-')
+    try:
+        with patched_env(env):
+            storage = Storage(os.path.join(workdir, 'bench.xlsx'))
+            t0 = time.perf_counter()
+            seed(storage, frames)
+            seed_ms = round((time.perf_counter() - t0) * 1000, 1)
+            results = []
+            for op, fn in operations(storage, size).items():
+                fn(0)  # warm the parse cache so p50 reflects steady state
+                res = measure(fn, repeat, budget)
+                results.append(dict(res, backend=name, size=size, op=op))
+                print(f"  {name:14} {size:>7} {op:16} p50 {res['p50_ms']:>10.2f} ms  "
+                      f"p95 {res['p95_ms']:>10.2f} ms  peak {res['peak_mem_kb']:>10.1f} KiB  (n={res['n']})",
+                      file=sys.stderr)
+            storage.flush_uploads()
+            if storage.uploader is not None:
+                storage.uploader.shutdown()
+            for r in results:
+                r['seed_ms'] = seed_ms
+            return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _git_rev():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def compare(current, baseline_path):
+    # p50 ratio per (backend, size, op) against an earlier results file
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['backend'], r['size'], r['op']): r for r in json.load(f)['results']}
+    print(f"{'backend':14} {'size':>7} {'op':16} {'base p50':>10} {'now p50':>10} {'ratio':>7}", file=sys.stderr)
+    for r in current:
+        b = baseline.get((r['backend'], r['size'], r['op']))
+        if b and b['p50_ms']:
+            ratio = r['p50_ms'] / b['p50_ms']
+            flag = '  <-- slower' if ratio > 1.25 else ''
+            print(f"{r['backend']:14} {r['size']:>7} {r['op']:16} {b['p50_ms']:>10.2f} {r['p50_ms']:>10.2f} "
+                  f"{ratio:>7.2f}{flag}", file=sys.stderr)
+
+
+def main(argv):
+    opts = {'--sizes': '1000,10000,100000', '--backends': ','.join(BACKENDS), '--repeat': '20',
+            '--budget': '30', '--out': '', '--compare': ''}
+    for i, a in enumerate(argv):
+        if a in opts and i + 1 < len(argv):
+            opts[a] = argv[i + 1]
+    sizes = [int(s) for s in opts['--sizes'].split(',') if s]
+    backends = [b for b in opts['--backends'].split(',') if b]
+    unknown = [b for b in backends if b not in BACKENDS]
+    if unknown:
+        raise SystemExit(f"unknown backend(s): {', '.join(unknown)}; choose from {', '.join(BACKENDS)}")
+    results, skipped = [], []
+    with local_s3() as s3_env:
+        for size in sizes:
+            frames = synthetic_tables(size)
+            for name in backends:
+                res = run_backend(name, size, frames, int(opts['--repeat']), float(opts['--budget']), s3_env)
+                if res is None:
+                    skipped.append(name)
+                else:
+                    results.extend(res)
+    report = {
+        'meta': {'created_at': datetime.utcnow().isoformat(), 'git_rev': _git_rev(),
+                 'python': platform.python_version(), 'pandas': pd.__version__, 'platform': platform.platform(),
+                 'sizes': sizes, 'backends': backends, 'skipped': sorted(set(skipped))},
+        'results': results,
+    }
+    data = json.dumps(report, indent=2)
+    if opts['--out']:
+        with open(opts['--out'], 'w', encoding='utf-8') as f:
+            f.write(data)
+    else:
+        print(data)
+    if opts['--compare']:
+        compare(results, opts['--compare'])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,258 @@
+# custody.py  (chain-of-custody helpers: head index, bulk verification and merkle proofs)
+import os
+import json
+import hmac
+import hashlib
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from journal import Journal
+from utils import compute_event_hash
+
+
+class ChainIndex:
+    # head event (hash, timestamp, event count) per case_number, persisted as an
+    # append-only NDJSON log so every worker can follow other workers' appends
+    def __init__(self, path):
+        self.log = Journal(path)
+        self.heads = {}
+        self.total = 0
+        self._ino = None
+        self._epoch = None
+        self._offset = 0
+
+    def exists(self):
+        return self.log.identity()[0] is not None
+
+    def refresh(self):
+        ino, size = self.log.identity()
+        epoch = self.log.epoch()
+        if ino != self._ino or epoch != self._epoch or size < self._offset:
+            # first load, or a rebuild swapped the file: replay from the start
+            self.heads, self.total, self._offset = {}, 0, 0
+            self._ino, self._epoch = ino, epoch
+        if size == self._offset:
+            return
+        records, self._offset = self.log.read_from(self._offset)
+        for rec in records:
+            self._apply(rec)
+
+    def _apply(self, rec):
+        if rec.get('op') == 'reset':
+            return
+        cn = rec['c']
+        head = self.heads.get(cn)
+        if head is None:
+            head = self.heads[cn] = {'hash': '', 'timestamp': '', 'count': 0}
+        if 'n' in rec:
+            head['count'] = rec['n']
+        else:
+            head['count'] += 1
+        # same tie-break as sorting by timestamp: the later append wins
+        if str(rec['t']) >= str(head['timestamp']):
+            head['hash'] = rec['h']
+            head['timestamp'] = str(rec['t'])
+        self.total = rec['total']
+
+    def head(self, case_number):
+        self.refresh()
+        return self.heads.get(str(case_number))
+
+    def record(self, events):
+        # callers hold the custody_events lock and have refreshed against the table
+        total = self.total
+        lines = []
+        for ev in events:
+            total += 1
+            lines.append({'c': str(ev.get('case_number', '')), 'h': ev.get('hash', ''),
+                          't': str(ev.get('timestamp', '')), 'total': total})
+        if lines:
+            self.log.append(lines)
+            self.refresh()
+
+    def rebuild(self, events_df):
+        # one pass over custody_events; the log is replaced by one line per case
+        lines = []
+        total = len(events_df)
+        if total:
+            df = events_df[['case_number', 'timestamp', 'hash']].copy()
+            df['case_number'] = df['case_number'].astype(str)
+            df['timestamp'] = df['timestamp'].astype(str)
+            df['_order'] = range(total)
+            counts = df.groupby('case_number').size()
+            heads = df.sort_values(['timestamp', '_order']).groupby('case_number').tail(1)
+            for row in heads.itertuples(index=False):
+                lines.append({'c': row.case_number, 'h': row.hash, 't': row.timestamp,
+                              'n': int(counts[row.case_number]), 'total': total})
+        self.log.reset()
+        if lines:
+            self.log.append(lines)
+        self.refresh()
+        return len(lines)
+
+
+# ---------- chain verification ----------
+
+def event_payload(ev):
+    # the fields the routes hash: sample_code only when the event names a sample
+    payload = {'actor': ev.get('actor', ''), 'action': ev.get('action', ''), 'timestamp': ev.get('timestamp', '')}
+    if ev.get('sample_code'):
+        payload['sample_code'] = ev['sample_code']
+    return payload
+
+
+def verify_chain(events, prev_hash=''):
+    # events in chain order; returns (ok, head_hash, failure dict or None)
+    for ev in events:
+        if str(ev.get('prev_hash', '')) != str(prev_hash):
+            return False, prev_hash, {'event_id': ev.get('id'), 'reason': 'broken_link'}
+        expected = compute_event_hash(prev_hash, event_payload(ev))
+        if str(ev.get('hash', '')) != expected:
+            return False, prev_hash, {'event_id': ev.get('id'), 'reason': 'hash_mismatch'}
+        prev_hash = ev.get('hash', '')
+    return True, prev_hash, None
+
+
+def _verify_cases(jobs):
+    # process-pool entry point: [(case_number, events, start, prev_hash)] -> results
+    results = []
+    for case_number, events, start, prev_hash in jobs:
+        ok, head, failure = verify_chain(events[start:], prev_hash)
+        results.append({'case_number': case_number, 'ok': ok, 'count': len(events),
+                        'head': head, 'checked': len(events) - start, 'failure': failure})
+    return results
+
+
+def _sign(key, body):
+    return hmac.new(key.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def load_checkpoint(path, key):
+    # returns (cases dict, status) where status is 'valid', 'missing' or 'invalid'
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}, 'missing'
+    body = json.dumps(data.get('cases', {}), sort_keys=True)
+    if not hmac.compare_digest(_sign(key, body), str(data.get('signature', ''))):
+        return {}, 'invalid'
+    return data.get('cases', {}), 'valid'
+
+
+def save_checkpoint(path, key, cases):
+    body = json.dumps(cases, sort_keys=True)
+    data = {'created_at': datetime.utcnow().isoformat(), 'cases': cases, 'signature': _sign(key, body)}
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def verify_custody(events, checkpoint_path, key, full=False, workers=None):
+    # verify every case's chain in one pass over custody_events; cases covered by
+    # a valid checkpoint only have the events added since then re-hashed
+    checkpoint, status = ({}, 'ignored') if full else load_checkpoint(checkpoint_path, key)
+    by_case = {}
+    for ev in events:
+        by_case.setdefault(str(ev.get('case_number', '')), []).append(ev)
+    jobs = []
+    for case_number, evs in by_case.items():
+        evs = chain_order(evs)
+        start, prev_hash = 0, ''
+        cp = checkpoint.get(case_number)
+        # the checkpointed prefix is trusted only if it still ends on the same hash
+        if cp and cp['count'] <= len(evs) and str(evs[cp['count'] - 1].get('hash', '')) == cp['head']:
+            start, prev_hash = cp['count'], cp['head']
+        jobs.append((case_number, evs, start, prev_hash))
+
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    if workers > 1 and len(jobs) > 1:
+        chunks = [jobs[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = [r for part in pool.map(_verify_cases, chunks) for r in part]
+    else:
+        results = _verify_cases(jobs)
+
+    failures = []
+    new_checkpoint = {}
+    for r in results:
+        if r['ok']:
+            new_checkpoint[r['case_number']] = {'count': r['count'], 'head': r['head']}
+        else:
+            failures.append(dict(r['failure'], case_number=r['case_number']))
+    save_checkpoint(checkpoint_path, key, new_checkpoint)
+    checked = sum(r['checked'] for r in results)
+    return {
+        'ok': not failures,
+        'cases': len(results),
+        'events': sum(r['count'] for r in results),
+        'verified_events': checked,
+        'skipped_events': sum(r['count'] for r in results) - checked,
+        'checkpoint': status,
+        'failures': sorted(failures, key=lambda f: f['case_number']),
+    }
+
+
+def _as_int(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return 0
+
+
+# ---------- merkle inclusion proofs ----------
+
+def _leaf(event_hash):
+    # domain-separated so a leaf can never be passed off as an inner node
+    return hashlib.sha256(b'\x00' + str(event_hash).encode('utf-8')).hexdigest()
+
+
+def _node(left, right):
+    return hashlib.sha256(b'\x01' + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+class MerkleTree:
+    # over a case's event hashes in chain order; an odd node is promoted unchanged
+    def __init__(self, event_hashes):
+        level = [_leaf(h) for h in event_hashes]
+        self.levels = [level]
+        while len(level) > 1:
+            nxt = [_node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+            if len(level) % 2:
+                nxt.append(level[-1])
+            self.levels.append(nxt)
+            level = nxt
+
+    @property
+    def size(self):
+        return len(self.levels[0])
+
+    @property
+    def root(self):
+        return self.levels[-1][0] if self.size else ''
+
+    def proof(self, index):
+        # sibling hashes from leaf to root: [{'hash', 'side'}], side of the sibling
+        path = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                path.append({'hash': level[sibling], 'side': 'left' if sibling < index else 'right'})
+            index //= 2
+        return path
+
+
+def verify_inclusion(event_hash, proof, root):
+    # standalone check for partner labs and courts: needs only the event hash,
+    # the proof and a trusted root
+    node = _leaf(event_hash)
+    for step in proof:
+        if step['side'] == 'left':
+            node = _node(step['hash'], node)
+        else:
+            node = _node(node, step['hash'])
+    return hmac.compare_digest(node, str(root))
+
+
+def chain_order(events):
+    return sorted(events, key=lambda e: (str(e.get('timestamp', '')), _as_int(e.get('id'))))
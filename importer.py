@@ -0,0 +1,158 @@
+# importer.py  (streaming bulk case import from CSV or XLSX)
+import csv
+import io
+import os
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from utils import compute_priorities, compute_event_hash, OFFENCE_WEIGHTS
+
+TRUTHY = {'1', 'true', 'yes', 'y', 'on'}
+MAX_REPORTED_ERRORS = 1000
+
+
+def _key(name):
+    return str(name or '').strip().lower().replace(' ', '_')
+
+
+def _cell(v):
+    if v is None:
+        return ''
+    if isinstance(v, datetime):
+        return v.isoformat()
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+def read_rows(source, filename=None):
+    # yields (line number, {column: text}) one row at a time; source is a path or
+    # a binary file object, and the format follows the file name (xlsx or csv)
+    name = (filename or (source if isinstance(source, (str, os.PathLike)) else '') or '').lower()
+    if str(name).endswith(('.xlsx', '.xlsm')):
+        return _xlsx_rows(source)
+    return _csv_rows(source)
+
+
+def _csv_rows(source):
+    if isinstance(source, (str, os.PathLike)):
+        f = open(source, encoding='utf-8-sig', newline='')
+    else:
+        f = io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+    with f:
+        reader = csv.reader(f)
+        header = [_key(h) for h in next(reader, [])]
+        for line, values in enumerate(reader, start=2):
+            if any(v.strip() for v in values):
+                yield line, dict(zip(header, values))
+
+
+def _xlsx_rows(source):
+    # read-only mode streams the sheet instead of building the whole workbook
+    from openpyxl import load_workbook
+    wb = load_workbook(source, read_only=True, data_only=True)
+    try:
+        ws = wb['cases'] if 'cases' in wb.sheetnames else wb.active
+        rows = ws.iter_rows(values_only=True)
+        header = [_key(h) for h in next(rows, ())]
+        for line, values in enumerate(rows, start=2):
+            row = {h: _cell(v) for h, v in zip(header, values) if h}
+            if any(v.strip() for v in row.values()):
+                yield line, row
+    finally:
+        wb.close()
+
+
+def _validate(row, seen, actor):
+    # (case, None) or (None, reason)
+    case_number = str(row.get('case_number', '')).strip()
+    if not case_number:
+        return None, 'missing case_number'
+    if case_number in seen:
+        return None, 'duplicate case_number'
+    created_at = str(row.get('created_at', '')).strip()
+    if created_at:
+        try:
+            parsed = datetime.fromisoformat(created_at)
+        except ValueError:
+            return None, 'invalid created_at'
+        if parsed.tzinfo is not None:
+            return None, 'created_at must be naive UTC (no offset)'
+    offence_type = _key(row.get('offence_type')) or 'other'
+    if offence_type not in OFFENCE_WEIGHTS:
+        return None, 'unknown offence_type'
+    case = {'case_number': case_number, 'offence_type': offence_type,
+            'description': str(row.get('description', '')).strip(), 'status': 'created', 'created_by': actor,
+            'suspect_in_custody': int(str(row.get('suspect_in_custody', '')).strip().lower() in TRUTHY)}
+    if created_at:
+        case['created_at'] = created_at
+    return case, None
+
+
+def _commit_chunk(storage, qr_store, cases, actor):
+    # one transaction per chunk: cases, their default samples and the first
+    # custody event of each chain are written together. Returns the sample codes
+    import pandas as pd
+    now = datetime.utcnow()
+    ts = now.isoformat()
+    for case in cases:
+        case.setdefault('created_at', ts)
+    scores = compute_priorities(pd.DataFrame(cases), now)
+    for case, score in zip(cases, scores.tolist()):
+        case['priority_score'] = int(score)
+    with storage.transaction('cases', 'samples', 'custody_events') as tx:
+        news = tx.append_many('cases', cases)
+        codes = [f"S-{int(c['id']):06d}-A" for c in news]
+        tx.append_many('samples', [{'case_number': c['case_number'], 'code': code, 'qr_path': qr_store.relpath(code),
+                                    'status': 'sealed'} for c, code in zip(news, codes)])
+        prev = tx.last_event_hashes([c['case_number'] for c in news])
+        events = []
+        for c, code in zip(news, codes):
+            prev_hash = prev[str(c['case_number'])]
+            payload = {'actor': actor, 'action': 'created_case', 'sample_code': code, 'timestamp': ts}
+            events.append({'case_number': c['case_number'], 'sample_code': code, 'actor': actor, 'action': 'created_case',
+                           'timestamp': ts, 'note': 'Case and sample created by import', 'prev_hash': prev_hash,
+                           'hash': compute_event_hash(prev_hash, payload)})
+        tx.append_many('custody_events', events)
+    return codes
+
+
+def import_cases(storage, qr_store, rows, actor, chunk_size=1000):
+    # rows: (line, dict) pairs as yielded by read_rows. Valid rows are committed
+    # chunk by chunk; a chunk's QR labels are drawn in the background while the
+    # next chunk is read and written. Rows whose case_number already exists (or
+    # repeats in the file) are reported, not imported
+    seen = {str(c.get('case_number')) for c in storage.all('cases')}
+    result = {'created': 0, 'chunks': 0, 'error_count': 0, 'errors': []}
+    renderer = ThreadPoolExecutor(max_workers=1)
+    rendering = None
+
+    def commit(batch):
+        nonlocal rendering
+        codes = _commit_chunk(storage, qr_store, batch, actor)
+        result['created'] += len(batch)
+        result['chunks'] += 1
+        if rendering is not None:
+            rendering.result()
+        rendering = renderer.submit(qr_store.render_many, codes)
+
+    try:
+        batch = []
+        for line, row in rows:
+            case, error = _validate(row, seen, actor)
+            if error:
+                result['error_count'] += 1
+                if len(result['errors']) < MAX_REPORTED_ERRORS:
+                    result['errors'].append({'line': line, 'case_number': str(row.get('case_number', '')), 'error': error})
+                continue
+            seen.add(case['case_number'])
+            batch.append(case)
+            if len(batch) >= chunk_size:
+                commit(batch)
+                batch = []
+        if batch:
+            commit(batch)
+        if rendering is not None:
+            rendering.result()
+    finally:
+        renderer.shutdown(wait=True)
+    return result
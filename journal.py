@@ -0,0 +1,156 @@
+# journal.py  (append-only NDJSON journal per table, folded into the workbook on compaction)
+import os
+import json
+import uuid
+import pandas as pd
+from schema import isin_mask, match_mask, plain_frame
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def append(self, records):
+        # one write + fsync per call; callers hold the table's exclusive lock
+        data = ''.join(json.dumps(r, default=str) + '\n' for r in records)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def identity(self):
+        # compaction swaps in a fresh file, so the inode tells readers to start over
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None, 0
+        return st.st_ino, st.st_size
+
+    def read_from(self, offset=0):
+        # returns (records, new_offset); a trailing partial line is left for the next read
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read()
+        except OSError:
+            return [], offset
+        end = chunk.rfind(b'\n')
+        if end < 0:
+            return [], offset
+        records = []
+        for line in chunk[:end].splitlines():
+            if line.strip():
+                records.append(json.loads(line))
+        return records, offset + end + 1
+
+    def reset(self):
+        # atomically replace with a fresh file instead of truncating in place; the
+        # epoch header tells readers apart from an older file that reused the inode
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'op': 'reset', 'epoch': uuid.uuid4().hex}) + '\n')
+        os.replace(tmp, self.path)
+
+    def epoch(self):
+        try:
+            with open(self.path, 'rb') as f:
+                first = f.readline()
+        except OSError:
+            return None
+        if not first.endswith(b'\n'):
+            return None
+        try:
+            rec = json.loads(first)
+        except ValueError:
+            return None
+        return rec.get('epoch') if rec.get('op') == 'reset' else None
+
+    def is_empty(self):
+        # nothing but (at most) the reset header
+        size = self.identity()[1]
+        if size == 0:
+            return True
+        try:
+            with open(self.path, 'rb') as f:
+                first = f.readline()
+        except OSError:
+            return True
+        return len(first) == size and self.epoch() is not None
+
+
+def bulk_update_frame(df, field, rows):
+    # rows: [{field: value, col: new, ...}]; one vectorised assignment per column
+    # instead of a mask per row. Returns (frame, number of matched rows)
+    if field not in df.columns or not rows:
+        return df, 0
+    updates = pd.DataFrame(rows)
+    updates[field] = updates[field].astype(str)
+    updates = updates.drop_duplicates(field, keep='last').set_index(field)
+    # matched on the column's native type; only the matched keys become text
+    mask = isin_mask(df[field], updates.index)
+    if not mask.any():
+        return df, 0
+    keys = plain_frame(df.loc[mask], [field])[field].astype(str)
+    df = df.copy()
+    for col in updates.columns:
+        if col not in df.columns:
+            df[col] = ''
+        values = keys.map(updates[col])
+        # a row may leave a column out; keep the current value there
+        df[col] = df[col].astype(object)
+        df.loc[mask, col] = values.where(values.notna(), df.loc[mask, col])
+    return df, int(mask.sum())
+
+
+def apply_records(df, records, append=None):
+    # replay journal records on top of a base frame; appends whose id is already
+    # present (the journal outlived a compaction that folded it in) are skipped.
+    # append(frame, rows) -> frame replaces the default concat of appended rows
+    if not records:
+        return df
+    df = df.copy()
+    known = set(pd.to_numeric(df['id'], errors='coerce').dropna().astype(int)) if 'id' in df.columns else set()
+    pending = []
+
+    def flush(frame):
+        if not pending:
+            return frame
+        if append is not None:
+            frame = append(frame, pending)
+            pending.clear()
+            return frame
+        new = pd.DataFrame(pending)
+        for c in new.columns:
+            if c not in frame.columns:
+                frame[c] = ''
+        new = new.reindex(columns=frame.columns, fill_value='')
+        frame = pd.concat([frame, new.fillna('')], ignore_index=True, sort=False)
+        pending.clear()
+        return frame
+
+    for rec in records:
+        if rec.get('op') == 'append':
+            row = rec['row']
+            rid = row.get('id')
+            if rid is not None and rid != '':
+                if int(rid) in known:
+                    continue
+                known.add(int(rid))
+            pending.append(row)
+        elif rec.get('op') == 'update':
+            df = flush(df)
+            field = rec['field']
+            if field not in df.columns:
+                continue
+            mask = match_mask(df, {field: rec['value']})
+            for k, v in rec['updates'].items():
+                if k not in df.columns:
+                    df[k] = ''
+                if df[k].dtype != object:
+                    # a typed column (categorical, Int64, ...) may reject the value
+                    df[k] = df[k].astype(object)
+                df.loc[mask, k] = v
+        elif rec.get('op') == 'bulk_update':
+            df, _ = bulk_update_frame(flush(df), rec['field'], rec['rows'])
+    return flush(df)
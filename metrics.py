@@ -0,0 +1,106 @@
+# metrics.py  (in-process timing histograms, rendered in the Prometheus text format)
+import bisect
+import functools
+import threading
+import time
+
+# seconds; from a cached dict lookup up to a cold workbook parse or a big S3 transfer
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}    # sorted label items -> [bucket counts..., +Inf], sum, count
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += seconds
+            s[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(k, list(v[0]), v[1], v[2]) for k, v in sorted(self._series.items())]
+        for key, counts, total, count in series:
+            base = ','.join(f'{k}="{_escape(v)}"' for k, v in key)
+            sep = ',' if base else ''
+            running = 0
+            for le, n in zip(self.buckets + (float('inf'),), counts):
+                running += n
+                le_text = '+Inf' if le == float('inf') else repr(le)
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{le_text}"}} {running}')
+            labels = f'{{{base}}}' if base else ''
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return '\n'.join(lines)
+
+
+class _Timer:
+    # context manager and decorator: observes the wall time of the block
+    def __init__(self, hist, labels):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self._t0, **self.labels)
+        return False
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Timer(self.hist, self.labels):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def histogram(name, help_text, buckets=BUCKETS):
+    with _registry_lock:
+        h = _registry.get(name)
+        if h is None:
+            h = _registry[name] = Histogram(name, help_text, buckets)
+        return h
+
+
+def instrument_methods(cls, hist, names):
+    # wrap each method so every call is observed with method=<name>
+    for name in names:
+        setattr(cls, name, hist.time(method=name)(getattr(cls, name)))
+
+
+def render():
+    with _registry_lock:
+        hists = sorted(_registry.values(), key=lambda h: h.name)
+    return '\n'.join(h.render() for h in hists) + '\n'
+
+
+HTTP_REQUESTS = histogram('fasttrack_http_request_duration_seconds', 'Request latency by route, method and status.')
+STORAGE_CALLS = histogram('fasttrack_storage_call_duration_seconds', 'Storage method latency, nested calls included.')
+S3_TRANSFERS = histogram('fasttrack_s3_transfer_duration_seconds', 'S3 download (conditional GET) and upload time.')
+LOCK_WAITS = histogram('fasttrack_table_lock_wait_seconds', 'Time spent waiting for a storage table lock, by mode.')
+QR_RENDERS = histogram('fasttrack_qr_render_seconds', 'QR label rendering, sync or submit-to-ready when async.')
+REPORT_RENDERS = histogram('fasttrack_report_render_seconds', 'Case PDF report rendering.')
+PASSWORD_HASHES = histogram('fasttrack_password_hash_seconds', 'Password hashing and verification.')
@@ -10,8 +10,10 @@ ROLE_ADMIN = "admin"
 ROLE_LAB = "lab"
 ROLE_OFFICER = "officer"
 
-# Ensure Excel sheets exist
-if not os.path.exists(EXCEL_FILE):
+# Ensure Excel sheets exist; called on first sheet access, not at import
+def ensure_workbook():
+    if os.path.exists(EXCEL_FILE):
+        return
     with pd.ExcelWriter(EXCEL_FILE) as writer:
         pd.DataFrame(columns=['id','email','name','role','password_hash','api_token']).to_excel(writer, sheet_name='users', index=False)
         pd.DataFrame(columns=['id','name','contact_email','is_active']).to_excel(writer, sheet_name='labs', index=False)
@@ -20,9 +22,11 @@ if not os.path.exists(EXCEL_FILE):
         pd.DataFrame(columns=['id','case_id','sample_id','actor_id','action','timestamp','note','prev_hash','hash']).to_excel(writer, sheet_name='custody_events', index=False)
 
 def load_sheet(sheet_name):
+    ensure_workbook()
     return pd.read_excel(EXCEL_FILE, sheet_name=sheet_name)
 
 def save_sheet(df, sheet_name):
+    ensure_workbook()
     with pd.ExcelWriter(EXCEL_FILE, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
         df.to_excel(writer, sheet_name=sheet_name, index=False)
 
@@ -0,0 +1,94 @@
+# qrstore.py  (content-addressed QR labels rendered off the request path)
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from utils import qr_digest, render_qr, save_qr
+from metrics import QR_RENDERS
+
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+class QRStore:
+    # Images live at <static>/qrcodes/<sha256>.png. submit() returns that path at
+    # once and renders in a process pool; until the file exists the qr route
+    # serves a placeholder. workers=0 renders inline.
+    def __init__(self, static_folder='static', workers=2):
+        self.static_folder = static_folder
+        self.workers = workers
+        self._pool = None
+        self._lock = threading.RLock()
+        self._inflight = {}    # digest -> future
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    @staticmethod
+    def is_digest(value):
+        return bool(_DIGEST.match(str(value)))
+
+    @staticmethod
+    def relpath(code):
+        return os.path.join('qrcodes', f"{qr_digest(code)}.png")
+
+    def path(self, digest):
+        return os.path.join(self.static_folder, 'qrcodes', f"{digest}.png")
+
+    def ready(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def submit(self, code):
+        digest = qr_digest(code)
+        rel = self.relpath(code)
+        if self.ready(digest):
+            return rel
+        if self.workers <= 0:
+            with QR_RENDERS.time(mode='sync'):
+                save_qr(self.path(digest), render_qr(code))
+            return rel
+        with self._lock:
+            if digest in self._inflight:
+                return rel
+            started = time.perf_counter()
+            fut = self._executor().submit(render_qr, code)
+            self._inflight[digest] = fut
+        fut.add_done_callback(lambda f, d=digest: self._finish(d, f, started))
+        return rel
+
+    def _finish(self, digest, fut, started):
+        try:
+            save_qr(self.path(digest), fut.result())
+            QR_RENDERS.observe(time.perf_counter() - started, mode='async')
+        except Exception as e:
+            print("QR render failed:", e)
+        finally:
+            with self._lock:
+                self._inflight.pop(digest, None)
+
+    def render_many(self, codes):
+        # bulk pre-render: codes that are missing on disk are drawn in parallel
+        # and written as they complete; returns {code: relpath}
+        paths = {code: self.relpath(code) for code in codes}
+        missing = list({code for code in paths if not self.ready(qr_digest(code))})
+        if missing:
+            if self.workers <= 0 or len(missing) == 1:
+                pngs = map(render_qr, missing)
+            else:
+                chunk = max(1, len(missing) // (self.workers * 4))
+                pngs = self._executor().map(render_qr, missing, chunksize=chunk)
+            for code, png in zip(missing, pngs):
+                save_qr(self.path(qr_digest(code)), png)
+        return paths
+
+    def wait(self, timeout=None):
+        with self._lock:
+            pending = list(self._inflight.values())
+        for fut in pending:
+            try:
+                fut.result(timeout)
+            except Exception:
+                pass
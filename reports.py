@@ -0,0 +1,149 @@
+# reports.py  (case PDF rendering, on-disk report cache and zip export)
+import os
+import hashlib
+import zipfile
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+
+
+def render_case_report(case_number, case, events, results):
+    # PDF bytes; module level so it can run in a process pool. reportlab is
+    # imported here so the web app does not load it until a report is drawn
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(40, height - 40, f"DNA FastTrack — Case Report: {case_number}")
+    c.setFont("Helvetica", 10)
+    c.drawString(40, height - 60, f"Offence: {case.get('offence_type','')}")
+    c.drawString(40, height - 75, f"Status: {case.get('status','')}")
+    c.drawString(40, height - 90, f"Created: {case.get('created_at','')}")
+    y = height - 120
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(40, y, "Chain of Custody:")
+    y -= 16
+    c.setFont("Helvetica", 9)
+    for ev in sorted(events, key=lambda e: e.get('timestamp','')):
+        line = f"{ev.get('timestamp','')} — {ev.get('actor','')} — {ev.get('action','')} — {ev.get('note','')}"
+        c.drawString(40, y, line[:120])
+        y -= 12
+        if y < 80:
+            c.showPage()
+            y = height - 40
+    if results:
+        c.setFont("Helvetica-Bold", 12)
+        c.drawString(40, y-10, "Lab Results:")
+        y -= 26
+        c.setFont("Helvetica", 9)
+        for r in results:
+            line = f"{r.get('created_at','')} — {r.get('lab_user','')} — {r.get('result_summary','')}"
+            c.drawString(40, y, line[:120])
+            y -= 12
+            if y < 80:
+                c.showPage()
+                y = height - 40
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def _render_job(job):
+    case_number, case, events, results = job
+    return render_case_report(case_number, case, events, results)
+
+
+class ReportCache:
+    # A report only changes when a custody event or lab result is added, so
+    # (case_number, custody head hash, lab result count) identifies its content.
+    # One file per case is kept; a newer version replaces the older one.
+    def __init__(self, directory):
+        self.directory = directory
+
+    @staticmethod
+    def key(case_number, head_hash, result_count):
+        raw = f"{case_number}|{head_hash}|{result_count}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _prefix(self, case_number):
+        return hashlib.sha256(str(case_number).encode('utf-8')).hexdigest()[:16]
+
+    def _path(self, case_number, key):
+        return os.path.join(self.directory, f"{self._prefix(case_number)}-{key}.pdf")
+
+    def get(self, case_number, key):
+        try:
+            with open(self._path(case_number, key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, case_number, key, pdf):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(case_number, key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(pdf)
+        os.replace(tmp, path)
+        prefix = self._prefix(case_number) + '-'
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith('.pdf') and os.path.join(self.directory, name) != path:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+class _Sink:
+    # write-only stream for ZipFile; the generator drains it after each member
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_zip(jobs, cache=None, workers=None):
+    # jobs: [(case_number, cache_key, case, events, results)]. Cached reports are
+    # used as-is, the rest are rendered in a process pool; the archive is yielded
+    # in chunks as each member is written, so nothing waits for the whole batch
+    sink = _Sink()
+    zf = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED)
+    misses = []
+    for case_number, key, case, events, results in jobs:
+        pdf = cache.get(case_number, key) if cache is not None else None
+        if pdf is None:
+            misses.append((case_number, key, case, events, results))
+            continue
+        zf.writestr(f"{case_number}_report.pdf", pdf)
+        yield sink.drain()
+    if misses:
+        workers = workers if workers is not None else (os.cpu_count() or 1)
+        render_jobs = [(cn, case, events, results) for cn, _, case, events, results in misses]
+        if workers > 1 and len(misses) > 1:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            pdfs = pool.map(_render_job, render_jobs)
+        else:
+            pool = None
+            pdfs = map(_render_job, render_jobs)
+        try:
+            for (case_number, key, *_), pdf in zip(misses, pdfs):
+                if cache is not None:
+                    cache.put(case_number, key, pdf)
+                zf.writestr(f"{case_number}_report.pdf", pdf)
+                yield sink.drain()
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+    zf.close()
+    yield sink.drain()
@@ -0,0 +1,104 @@
+# rwlock.py  (shared/exclusive file locks per table, across threads and worker processes)
+import os
+import threading
+from contextlib import contextmanager
+from metrics import LOCK_WAITS
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, every lock is taken exclusive
+    fcntl = None
+    from filelock import FileLock
+
+
+class TableLocks:
+    # One lock file per name in `directory`. Readers take it shared and writers
+    # exclusive, so readers in every gunicorn worker run side by side and only
+    # wait for (and hold off) a writer of the same table. flock() locks belong to
+    # the open file, so each thread opens its own handle and threads of one
+    # process exclude each other the same way processes do.
+    #
+    # Re-entrant per thread: while a lock is held exclusive it can be taken again
+    # in either mode. Asking for exclusive while holding it shared raises, since
+    # flock cannot upgrade atomically. Names passed together are always taken in
+    # sorted order, so writers that need several tables never deadlock.
+    def __init__(self, directory):
+        self.directory = directory or '.'
+        os.makedirs(self.directory, exist_ok=True)
+        self._local = threading.local()
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.lock")
+
+    def shared(self, *names):
+        return self._hold(names, exclusive=False)
+
+    def exclusive(self, *names):
+        return self._hold(names, exclusive=True)
+
+    def held(self, name):
+        # None, 'shared' or 'exclusive' for the calling thread
+        entry = self._held().get(name)
+        if entry is None:
+            return None
+        return 'exclusive' if entry[0] else 'shared'
+
+    def _held(self):
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            held = self._local.held = {}    # name -> [exclusive, depth, handle]
+        return held
+
+    @contextmanager
+    def _hold(self, names, exclusive):
+        taken = []
+        try:
+            for name in sorted(set(names)):
+                self._acquire(name, exclusive)
+                taken.append(name)
+            yield
+        finally:
+            for name in reversed(taken):
+                self._release(name)
+
+    def _acquire(self, name, exclusive):
+        held = self._held()
+        entry = held.get(name)
+        if entry is not None:
+            if exclusive and not entry[0]:
+                raise RuntimeError(f"lock '{name}' is held shared by this thread and cannot be upgraded")
+            entry[1] += 1
+            return
+        with LOCK_WAITS.time(mode='exclusive' if exclusive else 'shared'):
+            handle = self._lock_file(name, exclusive)
+        held[name] = [exclusive, 1, handle]
+
+    def _release(self, name):
+        held = self._held()
+        entry = held[name]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del held[name]
+            self._unlock_file(entry[2])
+
+    def _lock_file(self, name, exclusive):
+        if fcntl is None:
+            lock = FileLock(self.path(name))
+            lock.acquire()
+            return lock
+        fd = os.open(self.path(name), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
+
+    def _unlock_file(self, handle):
+        if fcntl is None:
+            handle.release()
+            return
+        try:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        finally:
+            os.close(handle)
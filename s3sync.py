@@ -0,0 +1,127 @@
+# s3sync.py  (background uploader that coalesces bursts of writes into one put_object per object)
+import atexit
+import threading
+import time
+
+
+class S3Uploader:
+    def __init__(self, upload_fn, debounce=2.0, max_delay=10.0, retry_delay=5.0):
+        # upload_fn(keys) -> bool, keys is the set of dirty object keys (or None
+        # when only whole-object writes were marked); called on the uploader thread only
+        self.upload_fn = upload_fn
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.retry_delay = retry_delay
+        self.pending = 0      # writes not yet covered by a successful upload
+        self.uploaded = 0     # successful put_object calls
+        self.failed = 0       # failed put_object calls (retried)
+        self.coalesced = 0    # writes that rode along with another write's upload
+        self._cond = threading.Condition()
+        self._dirty = False
+        self._uploading = False
+        self._first_mark = 0.0
+        self._last_mark = 0.0
+        self._not_before = 0.0
+        self._flush = False
+        self._stopping = False
+        self._thread = None
+        self._keys = set()       # dirty object keys; empty means "everything"
+        self._inflight = set()
+        atexit.register(self.shutdown)
+
+    def mark_dirty(self, key=None):
+        with self._cond:
+            if key is not None:
+                self._keys.add(key)
+            now = time.monotonic()
+            if not self._dirty:
+                self._first_mark = now
+            self._dirty = True
+            self._last_mark = now
+            self.pending += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='s3-uploader', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def has_pending(self, key=None):
+        with self._cond:
+            if key is None or not (self._keys or self._inflight):
+                return self._dirty or self._uploading
+            return key in self._keys or key in self._inflight
+
+    def stats(self):
+        with self._cond:
+            return {'pending': self.pending, 'uploaded': self.uploaded,
+                    'failed': self.failed, 'coalesced': self.coalesced}
+
+    def flush(self, timeout=30.0):
+        # upload now instead of waiting out the debounce window; True once clean
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self._thread is None:
+                return not self._dirty
+            self._flush = True
+            self._cond.notify_all()
+            while self._dirty or self._uploading:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self._flush = False
+            return True
+
+    def shutdown(self, timeout=30.0):
+        ok = self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        return ok
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._dirty and not self._stopping:
+                    self._cond.wait()
+                if self._stopping and not self._dirty:
+                    return
+                # debounce: wait for a quiet window, but never longer than max_delay;
+                # a flush skips the window but still honours the retry back-off
+                while True:
+                    now = time.monotonic()
+                    if self._flush or self._stopping:
+                        target = self._not_before
+                    else:
+                        target = max(min(self._last_mark + self.debounce,
+                                         self._first_mark + self.max_delay), self._not_before)
+                    if now >= target:
+                        break
+                    self._cond.wait(target - now)
+                batch = self.pending
+                keys = set(self._keys)
+                self._keys.clear()
+                self._inflight = keys
+                self.pending = 0
+                self._dirty = False
+                self._uploading = True
+            ok = False
+            try:
+                ok = self.upload_fn(keys or None)
+            except Exception as e:
+                print("S3 upload failed:", e)
+            with self._cond:
+                self._uploading = False
+                self._inflight = set()
+                if ok:
+                    self.uploaded += 1
+                    self.coalesced += max(batch - 1, 0)
+                else:
+                    self.failed += 1
+                    # keep the data dirty and retry after a pause
+                    if not self._dirty:
+                        self._first_mark = time.monotonic()
+                    self._dirty = True
+                    self._keys |= keys
+                    self.pending += batch
+                    self._not_before = time.monotonic() + self.retry_delay
+                self._cond.notify_all()
@@ -0,0 +1,175 @@
+# scheduler.py  (priority-aware dispatch of unassigned cases to labs)
+import heapq
+import threading
+import time
+
+
+def _as_int(v, default=0):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return default
+
+
+def _is_active(v):
+    return str(v).strip().lower() not in ('', '0', 'false', 'no', 'none')
+
+
+def _key(c):
+    # same order as the dashboard: priority_score desc, then oldest first
+    return (-_as_int(c.get('priority_score')), str(c.get('created_at', '')),
+            _as_int(c.get('id')), str(c.get('case_number', '')))
+
+
+class LabScheduler:
+    # A lab is keyed by its contact_email, which is also what lab users write to
+    # cases.lab_assigned when they receive a case. The heaps are rebuilt from
+    # storage every refresh_interval seconds (other workers dispatch too);
+    # in between, each dispatch is a couple of heap operations and entries
+    # made stale by someone else are dropped when they reach the top.
+    def __init__(self, storage, refresh_interval=30.0, default_capacity=20):
+        self.storage = storage
+        self.refresh_interval = refresh_interval
+        self.default_capacity = default_capacity
+        self._lock = threading.RLock()
+        self._queue = []        # unassigned open cases
+        self._lab_queues = {}   # lab -> cases assigned to it but not yet received
+        self._load = {}         # lab -> open cases assigned (queued + in_lab)
+        self._capacity = {}     # lab -> capacity, active labs only
+        self._labs = []         # (load, lab); stale entries are skipped on pop
+        self._loaded_at = None
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def refresh(self, force=False):
+        with self._lock:
+            if (not force and self._loaded_at is not None
+                    and time.monotonic() - self._loaded_at < self.refresh_interval):
+                return
+            capacity = {}
+            for lab in self.storage.all('labs'):
+                email = str(lab.get('contact_email', '')).strip()
+                if email and _is_active(lab.get('is_active')):
+                    capacity[email] = _as_int(lab.get('capacity'), 0) or self.default_capacity
+            queue, lab_queues, load = [], {}, {}
+            for c in self.storage.all('cases'):
+                status = str(c.get('status', ''))
+                if status == 'completed':
+                    continue
+                lab = str(c.get('lab_assigned', '')).strip()
+                if not lab:
+                    queue.append(_key(c))
+                    continue
+                load[lab] = load.get(lab, 0) + 1
+                if status != 'in_lab':
+                    lab_queues.setdefault(lab, []).append(_key(c))
+            heapq.heapify(queue)
+            for q in lab_queues.values():
+                heapq.heapify(q)
+            self._queue, self._lab_queues, self._load, self._capacity = queue, lab_queues, load, capacity
+            self._labs = [(load.get(lab, 0), lab) for lab in capacity]
+            heapq.heapify(self._labs)
+            self._loaded_at = time.monotonic()
+
+    def add(self, case):
+        # a freshly created case joins the queue without waiting for a refresh
+        with self._lock:
+            if not str(case.get('lab_assigned', '')).strip():
+                heapq.heappush(self._queue, _key(case))
+
+    def stats(self):
+        with self._lock:
+            self.refresh()
+            return {'unassigned': len(self._queue),
+                    'labs': {lab: {'capacity': cap, 'load': self._load.get(lab, 0),
+                                   'queued': len(self._lab_queues.get(lab, []))}
+                             for lab, cap in self._capacity.items()}}
+
+    def _pick_lab(self):
+        # the active lab with the shortest queue that still has spare capacity
+        while self._labs:
+            load, lab = self._labs[0]
+            if lab not in self._capacity or load != self._load.get(lab, 0):
+                heapq.heappop(self._labs)   # stale entry
+                continue
+            if load >= self._capacity[lab]:
+                heapq.heappop(self._labs)   # full; comes back after the next refresh
+                continue
+            return lab
+        return None
+
+    def _spare(self):
+        return sum(max(0, cap - self._load.get(lab, 0)) for lab, cap in self._capacity.items())
+
+    def _take(self, tx, want, pick):
+        # pops up to `want` cases off the queue and re-checks them against one
+        # read of the cases table (another worker may have assigned or received
+        # them since the last refresh); each live case goes to pick() -> lab,
+        # and stale entries are dropped. Returns the claimed cases
+        claimed = []
+        while self._queue and len(claimed) < want:
+            keys = [heapq.heappop(self._queue) for _ in range(min(want - len(claimed), len(self._queue)))]
+            current = tx.find_many('cases', 'case_number', [k[3] for k in keys])
+            for i, key in enumerate(keys):
+                c = current.get(key[3])
+                if (not c or str(c.get('status', '')) == 'completed'
+                        or str(c.get('lab_assigned', '')).strip()):
+                    continue
+                lab = pick()
+                if lab is None:
+                    for k in keys[i:]:
+                        heapq.heappush(self._queue, k)
+                    return claimed
+                heapq.heappush(self._lab_queues.setdefault(lab, []), key)
+                self._load[lab] = self._load.get(lab, 0) + 1
+                heapq.heappush(self._labs, (self._load[lab], lab))
+                c['lab_assigned'] = lab
+                claimed.append(c)
+        return claimed
+
+    def _claim(self, want, pick):
+        # all claims of one dispatch are checked and written in a single
+        # transaction, so the table is rewritten once rather than once per case
+        if want <= 0 or not self._queue:
+            return []
+        try:
+            with self.storage.transaction('cases') as tx:
+                claimed = self._take(tx, want, pick)
+                if claimed:
+                    tx.bulk_update('cases', 'case_number', [{'case_number': c['case_number'],
+                                                             'lab_assigned': c['lab_assigned']} for c in claimed])
+        except Exception:
+            self.invalidate()   # the heaps already reflect claims that weren't written
+            raise
+        return claimed
+
+    def dispatch(self, limit=None):
+        # assign the highest-priority unassigned cases, each to the least loaded
+        # lab with room; returns [(case_number, lab)]
+        with self._lock:
+            self.refresh()
+            want = self._spare() if limit is None else min(limit, self._spare())
+            claimed = self._claim(want, self._pick_lab)
+        return [(c['case_number'], c['lab_assigned']) for c in claimed]
+
+    def next_case(self, lab, claim=True):
+        # the top of this lab's own queue; when that is empty and the lab has room,
+        # the best unassigned case is dispatched to it (claim=False only looks at
+        # the lab's own queue and writes nothing). Returns None when idle
+        lab = str(lab).strip()
+        with self._lock:
+            self.refresh()
+            q = self._lab_queues.get(lab, [])
+            current = self.storage.find_many('cases', 'case_number', [k[3] for k in q]) if q else {}
+            while q:
+                c = current.get(q[0][3])
+                if (c and str(c.get('lab_assigned', '')).strip() == lab
+                        and str(c.get('status', '')) not in ('in_lab', 'completed')):
+                    return c
+                heapq.heappop(q)
+            if claim and lab in self._capacity and self._load.get(lab, 0) < self._capacity[lab]:
+                claimed = self._claim(1, lambda: lab)
+                return claimed[0] if claimed else None
+        return None
@@ -0,0 +1,164 @@
+# schema.py  (typed in-memory tables: nullable ints, categoricals and datetimes)
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlite_backend import INTEGER_COLUMNS
+
+# Cached frames keep these columns in native types; every other column holds
+# plain str ('' when blank). A column whose values don't convert losslessly
+# (text in an id column, timestamps with an offset, ...) stays str, so nothing
+# read from a file changes when it is written back.
+INT_COLUMNS = INTEGER_COLUMNS | {'suspect_in_custody'}
+CATEGORY_COLUMNS = {'status', 'role', 'offence_type', 'action', 'actor', 'lab_assigned', 'lab_user'}
+DATETIME_COLUMNS = {'created_at', 'timestamp'}
+
+
+def _as_text(v):
+    if isinstance(v, str):
+        return v
+    if v is None or v is pd.NA or v is pd.NaT or (isinstance(v, float) and np.isnan(v)):
+        return ''
+    if isinstance(v, datetime):
+        return v.isoformat()
+    return str(v)
+
+
+def _text(col):
+    if pd.api.types.infer_dtype(col, skipna=False) in ('string', 'empty'):
+        return col if col.dtype == object else col.astype(object)
+    return col.astype(object).map(_as_text)
+
+
+def iso_strings(col):
+    # datetime64 column -> datetime.isoformat() strings ('' for NaT), vectorised
+    values = col.to_numpy(dtype='datetime64[us]')
+    out = np.datetime_as_string(values, unit='us')
+    whole = values.astype('int64') % 1_000_000 == 0
+    out = np.where(whole, out.astype('U19'), out).astype(object)
+    out[np.isnat(values)] = ''
+    return pd.Series(out, index=col.index, dtype=object)
+
+
+def _typed_column(name, col):
+    if name in INT_COLUMNS:
+        if isinstance(col.dtype, pd.Int64Dtype):
+            return col
+        raw = col.astype(object)
+        if pd.api.types.infer_dtype(raw, skipna=True) in ('boolean', 'mixed'):
+            raw = raw.map(lambda v: int(v) if isinstance(v, bool) else v)
+        blank = raw.isna() | (raw == '')
+        num = pd.to_numeric(raw.where(~blank, None), errors='coerce')
+        if num[~blank].isna().any() or (num.dropna() % 1 != 0).any():
+            return _text(col)
+        return num.astype('Int64')
+    if name in CATEGORY_COLUMNS:
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            return col
+        return _text(col).astype('category')
+    if name in DATETIME_COLUMNS:
+        if pd.api.types.is_datetime64_dtype(col.dtype):
+            return col
+        text = _text(col)
+        parsed = pd.to_datetime(text.where(text != '', None), errors='coerce', format='ISO8601')
+        if getattr(parsed.dt, 'tz', None) is not None or not (iso_strings(parsed) == text).all():
+            return text
+        return parsed.astype('datetime64[ns]')
+    if col.dtype == object:
+        return _text(col)
+    return col.astype(object).map(_as_text)
+
+
+def typed_frame(df, columns=None):
+    # converts the given columns (default: all) in place of a copy; columns that
+    # already have their type are left alone, so this is cheap after small edits
+    df = df.copy() if columns is None else df
+    for name in (df.columns if columns is None else columns):
+        if name in df.columns:
+            df[name] = _typed_column(name, df[name])
+    return df
+
+
+def concat_rows(df, rows):
+    # df plus new rows (dicts or a frame) as one typed frame. Categoricals are
+    # given the union of both sides' categories first, so the concat doesn't
+    # widen them (or anything else) to object and the big frame isn't converted again
+    df = df.copy(deep=False)
+    new = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+    new = typed_frame(new.reindex(columns=list(df.columns) + [c for c in new.columns if c not in df.columns]))
+    for name in df.columns:
+        a, b = df[name], new[name]
+        if isinstance(a.dtype, pd.CategoricalDtype) and isinstance(b.dtype, pd.CategoricalDtype):
+            extra = b.cat.categories.difference(a.cat.categories)
+            if len(extra):
+                a = df[name] = a.cat.add_categories(extra)
+            new[name] = b.cat.set_categories(a.cat.categories)
+    out = pd.concat([df, new], ignore_index=True, sort=False)
+    return typed_frame(out, [c for c in out.columns if out[c].dtype == object])
+
+
+def plain_frame(df, columns=None):
+    # the inverse: object columns of python ints and str, as files and callers expect
+    cols = list(df.columns) if columns is None else [c for c in columns if c in df.columns]
+    out = {}
+    for name in cols:
+        col = df[name]
+        if pd.api.types.is_datetime64_dtype(col.dtype):
+            out[name] = iso_strings(col)
+        elif isinstance(col.dtype, (pd.Int64Dtype, pd.CategoricalDtype)):
+            obj = col.astype(object)
+            out[name] = obj.where(col.notna(), '')
+        else:
+            out[name] = col
+    return pd.DataFrame(out, index=df.index, columns=cols)
+
+
+def records(df):
+    return plain_frame(df).to_dict(orient='records')
+
+
+def isin_mask(col, values):
+    # boolean mask of the rows whose value is one of `values`, compared on the
+    # column's native type; values that can't be of that type match nothing
+    if isinstance(col.dtype, pd.Int64Dtype):
+        wanted = []
+        for v in values:
+            try:
+                wanted.append(int(v))
+            except (TypeError, ValueError):
+                pass
+        return col.isin(wanted).fillna(False).to_numpy(dtype=bool)
+    if pd.api.types.is_datetime64_dtype(col.dtype):
+        wanted = []
+        for v in values:
+            try:
+                wanted.append(pd.Timestamp(v))
+            except (TypeError, ValueError):
+                pass
+        return col.isin(wanted).to_numpy(dtype=bool)
+    return col.isin([_as_text(v) for v in values]).to_numpy(dtype=bool)
+
+
+def match_mask(df, kwargs):
+    # boolean mask for equality filters on native types, or None when a column
+    # is unknown; a value that can't be of the column's type matches nothing
+    mask = np.ones(len(df), dtype=bool)
+    for k, v in kwargs.items():
+        if k not in df.columns:
+            return None
+        col = df[k]
+        if isinstance(col.dtype, pd.Int64Dtype):
+            try:
+                v = int(v)
+            except (TypeError, ValueError):
+                return np.zeros(len(df), dtype=bool)
+            hit = (col == v).fillna(False).to_numpy(dtype=bool)
+        elif pd.api.types.is_datetime64_dtype(col.dtype):
+            try:
+                v = pd.Timestamp(v)
+            except (TypeError, ValueError):
+                return np.zeros(len(df), dtype=bool)
+            hit = (col == v).to_numpy()
+        else:
+            hit = (col == _as_text(v)).to_numpy(dtype=bool)
+        mask &= hit
+    return mask
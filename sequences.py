@@ -0,0 +1,78 @@
+# sequences.py  (persisted per-table id sequences, handed out to workers in blocks)
+import os
+import json
+import threading
+
+
+class SequenceStore:
+    # The file maps table -> the next id nobody has reserved yet. A worker reserves
+    # `block` ids at a time under a short exclusive lock and hands them out from
+    # memory, so an id costs O(1) and no two workers ever share one. Ids increase
+    # within a worker but interleave across workers, and a worker that exits
+    # leaves the rest of its block unused.
+    #
+    # take() callers hold the table's exclusive lock; `seed` (table -> first free
+    # id, from the table itself) only runs the first time a table is seen.
+    def __init__(self, path, locks, seed, block=50):
+        self.path = path
+        self.locks = locks
+        self.seed = seed
+        self.block = max(1, int(block))
+        self._blocks = {}    # table -> (next id, end of block)
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, data):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def _reserve(self, table, n):
+        # first id of n fresh consecutive ids
+        with self.locks.exclusive('sequences'):
+            data = self._read()
+            if table not in data:
+                data[table] = self.seed(table)
+            start = int(data[table])
+            data[table] = start + n
+            self._write(data)
+        return start
+
+    def take(self, table, n=1):
+        # first of n consecutive ids; a batch that doesn't fit the current
+        # block gets a fresh one so its ids stay contiguous
+        with self._lock:
+            nxt, end = self._blocks.get(table, (0, 0))
+            if end - nxt < n:
+                size = max(n, self.block)
+                nxt = self._reserve(table, size)
+                end = nxt + size
+            self._blocks[table] = (nxt + n, end)
+            return nxt
+
+    def peek(self, table):
+        # the id take() would hand out next, without reserving anything
+        with self._lock:
+            nxt, end = self._blocks.get(table, (0, 0))
+            if nxt < end:
+                return nxt
+        data = self._read()
+        return int(data[table]) if table in data else self.seed(table)
+
+    def resync(self, table, first_free):
+        # after rows were written with ids from elsewhere (an import), make sure
+        # nothing at or below their ids is handed out again
+        with self._lock, self.locks.exclusive('sequences'):
+            self._blocks.pop(table, None)
+            data = self._read()
+            data[table] = max(int(data.get(table, 1)), int(first_free))
+            self._write(data)
@@ -0,0 +1,410 @@
+# sqlite_backend.py  (row-level SQLite backend used by Storage when STORAGE_BACKEND=sqlite)
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+from utils import encode_cursor, decode_cursor
+
+# columns that are not stored as TEXT; everything else round-trips as strings
+INTEGER_COLUMNS = {'id', 'priority_score', 'is_active', 'capacity'}
+
+# (table, columns) pairs that get a secondary index
+INDEXES = [
+    ('users', ('email',)),
+    ('users', ('api_token',)),
+    ('cases', ('case_number',)),
+    ('cases', ('priority_score DESC', 'created_at', 'id')),
+    ('cases', ('status',)),
+    ('samples', ('case_number',)),
+    ('samples', ('code',)),
+    ('custody_events', ('case_number', 'timestamp')),
+    ('custody_events', ('sample_code',)),
+    ('lab_results', ('case_number',)),
+]
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SQLiteBackend:
+    def __init__(self, db_path, tables):
+        self.db_path = db_path
+        self.tables = tables
+        self._local = threading.local()
+        self._columns = {}
+        self.ensure_schema()
+
+    @property
+    def conn(self):
+        # sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def ensure_schema(self):
+        conn = self.conn
+        for table, cols in self.tables.items():
+            defs = []
+            for c in cols:
+                if c == 'id':
+                    defs.append('"id" INTEGER PRIMARY KEY')
+                elif c in INTEGER_COLUMNS:
+                    defs.append(f"{_quote(c)} INTEGER")
+                else:
+                    defs.append(f"{_quote(c)} TEXT DEFAULT ''")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table)} ({', '.join(defs)})")
+        for table, cols in INDEXES:
+            # a column may carry a sort order, e.g. 'priority_score DESC'
+            parts = [c.split() for c in cols]
+            name = f"ix_{table}_{'_'.join(p[0] for p in parts)}"
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {_quote(name)} ON {_quote(table)} "
+                         f"({', '.join(' '.join([_quote(p[0])] + p[1:]) for p in parts)})")
+        # head of each case's custody chain, maintained on every custody append
+        conn.execute("CREATE TABLE IF NOT EXISTS custody_heads ("
+                     "case_number TEXT PRIMARY KEY, hash TEXT, timestamp TEXT, count INTEGER)")
+        self._columns = {}
+        if (conn.execute("SELECT 1 FROM custody_events LIMIT 1").fetchone()
+                and not conn.execute("SELECT 1 FROM custody_heads LIMIT 1").fetchone()):
+            self.rebuild_chain_index()
+
+    def columns(self, table):
+        cols = self._columns.get(table)
+        if cols is None:
+            cols = [r['name'] for r in self.conn.execute(f"PRAGMA table_info({_quote(table)})")]
+            self._columns[table] = cols
+        return cols
+
+    def _add_missing_columns(self, table, keys):
+        # the workbook backends accept ad-hoc columns, so mirror that here
+        for k in keys:
+            if k not in self.columns(table):
+                self.conn.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(k)} TEXT DEFAULT ''")
+                self._columns.pop(table, None)
+
+    @staticmethod
+    def _bind(col, value):
+        if value is None or (isinstance(value, float) and pd.isna(value)):
+            return None if col in INTEGER_COLUMNS else ''
+        if col in INTEGER_COLUMNS:
+            if isinstance(value, bool):
+                return int(value)
+            if isinstance(value, str) and value.lower() in ('true', 'false'):
+                return int(value.lower() == 'true')
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return value
+        return str(value)
+
+    @staticmethod
+    def _row(r):
+        return {k: ('' if r[k] is None else r[k]) for k in r.keys()}
+
+    def _where(self, table, kwargs):
+        cols = self.columns(table)
+        clauses, params = [], []
+        for k, v in kwargs.items():
+            if k not in cols:
+                return None, None
+            clauses.append(f"{_quote(k)} = ?")
+            params.append(self._bind(k, v))
+        sql = (' WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        return sql, params
+
+    def read_frame(self, table):
+        df = pd.read_sql_query(f"SELECT * FROM {_quote(table)} ORDER BY id", self.conn)
+        return df.fillna('')
+
+    def replace_frame(self, table, df):
+        # full-table rewrite, only used by callers that need DataFrame semantics
+        self._add_missing_columns(table, df.columns)
+        cols = list(df.columns)
+        rows = [tuple(self._bind(c, v) for c, v in zip(cols, rec))
+                for rec in df.itertuples(index=False, name=None)]
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(f"DELETE FROM {_quote(table)}")
+            if rows:
+                conn.executemany(f"INSERT INTO {_quote(table)} ({', '.join(_quote(c) for c in cols)}) "
+                                 f"VALUES ({', '.join('?' for _ in cols)})", rows)
+            if table == 'custody_events':
+                self._rebuild_heads()
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front so concurrent
+        # read-then-append sequences (custody hash chain) cannot interleave
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def all(self, table):
+        return [self._row(r) for r in self.conn.execute(f"SELECT * FROM {_quote(table)} ORDER BY id")]
+
+    def find(self, table, **kwargs):
+        where, params = self._where(table, kwargs)
+        if where is None:
+            return None
+        r = self.conn.execute(f"SELECT * FROM {_quote(table)}{where} ORDER BY id LIMIT 1", params).fetchone()
+        return self._row(r) if r is not None else None
+
+    def find_many(self, table, field, values):
+        # {str(value): first row by id} for many values, as IN queries of 500
+        if field not in self.columns(table):
+            return {}
+        keys = list(dict.fromkeys(values))
+        found = {}
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            for r in self.conn.execute(f"SELECT * FROM {_quote(table)} WHERE {_quote(field)} IN "
+                                       f"({', '.join('?' * len(part))}) ORDER BY id",
+                                       [self._bind(field, v) for v in part]):
+                row = self._row(r)
+                found.setdefault(str(row[field]), row)
+        return found
+
+    def filter(self, table, **kwargs):
+        where, params = self._where(table, kwargs)
+        if where is None:
+            return []
+        return [self._row(r) for r in self.conn.execute(f"SELECT * FROM {_quote(table)}{where} ORDER BY id", params)]
+
+    def append(self, table, row: dict):
+        new = {k: v for k, v in row.items() if k != 'id'}
+        if 'created_at' in self.tables[table] and 'created_at' not in new:
+            new['created_at'] = datetime.utcnow().isoformat()
+        self._add_missing_columns(table, new.keys())
+        cols = list(new.keys())
+        conn = self.conn
+        # the custody head must move in the same transaction as the event insert
+        own_tx = table == 'custody_events' and not conn.in_transaction
+        if own_tx:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            cur = conn.execute(
+                f"INSERT INTO {_quote(table)} ({', '.join(_quote(c) for c in cols)}) "
+                f"VALUES ({', '.join('?' for _ in cols)})",
+                [self._bind(c, new[c]) for c in cols])
+            if table == 'custody_events':
+                conn.execute(
+                    "INSERT INTO custody_heads (case_number, hash, timestamp, count) VALUES (?, ?, ?, 1) "
+                    "ON CONFLICT(case_number) DO UPDATE SET count = count + 1, "
+                    "hash = CASE WHEN excluded.timestamp >= timestamp THEN excluded.hash ELSE hash END, "
+                    "timestamp = CASE WHEN excluded.timestamp >= timestamp THEN excluded.timestamp ELSE timestamp END",
+                    (self._bind('case_number', new.get('case_number')), self._bind('hash', new.get('hash')),
+                     self._bind('timestamp', new.get('timestamp'))))
+            if own_tx:
+                conn.execute('COMMIT')
+        except Exception:
+            if own_tx:
+                conn.execute('ROLLBACK')
+            raise
+        if 'id' in self.tables[table]:
+            new['id'] = cur.lastrowid
+        return new
+
+    def append_many(self, table, rows):
+        conn = self.conn
+        own = not conn.in_transaction
+        if own:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            news = [self.append(table, r) for r in rows]
+            if own:
+                conn.execute('COMMIT')
+        except Exception:
+            if own:
+                conn.execute('ROLLBACK')
+            raise
+        return news
+
+    def update(self, table, id_field, id_value, updates: dict):
+        if id_field not in self.columns(table):
+            return False
+        if not updates:
+            return self.find(table, **{id_field: id_value}) is not None
+        self._add_missing_columns(table, updates.keys())
+        sets = ', '.join(f"{_quote(k)} = ?" for k in updates)
+        params = [self._bind(k, v) for k, v in updates.items()]
+        params.append(self._bind(id_field, id_value))
+        cur = self.conn.execute(f"UPDATE {_quote(table)} SET {sets} WHERE {_quote(id_field)} = ?", params)
+        return cur.rowcount > 0
+
+    def bulk_update(self, table, id_field, rows):
+        # executemany per distinct column set, inside one transaction
+        if id_field not in self.columns(table) or not rows:
+            return 0
+        groups = {}
+        for r in rows:
+            cols = tuple(k for k in r if k != id_field)
+            if cols:
+                groups.setdefault(cols, []).append(r)
+        self._add_missing_columns(table, {k for cols in groups for k in cols})
+        conn = self.conn
+        own = not conn.in_transaction
+        if own:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            n = 0
+            for cols, group in groups.items():
+                sets = ', '.join(f"{_quote(k)} = ?" for k in cols)
+                params = [[self._bind(k, r[k]) for k in cols] + [self._bind(id_field, r[id_field])] for r in group]
+                n += conn.executemany(f"UPDATE {_quote(table)} SET {sets} WHERE {_quote(id_field)} = ?",
+                                      params).rowcount
+            if own:
+                conn.execute('COMMIT')
+        except Exception:
+            if own:
+                conn.execute('ROLLBACK')
+            raise
+        return n
+
+    def query_cases(self, limit=200, cursor=None, status=None, lab=None):
+        # keyset pagination over ix_cases_priority_score_created_at_id
+        where, params = [], []
+        if lab:
+            where.append('lab_assigned = ?')
+            params.append(str(lab))
+        counts = {str(r['status']): r['n'] for r in self.conn.execute(
+            "SELECT status, COUNT(*) AS n FROM cases" + (' WHERE ' + ' AND '.join(where) if where else '')
+            + " GROUP BY status", params)}
+        if status:
+            where.append('status = ?')
+            params.append(str(status))
+        base = ' AND '.join(where)
+        total = self.conn.execute("SELECT COUNT(*) AS n FROM cases" + (' WHERE ' + base if base else ''),
+                                  params).fetchone()['n']
+        page_where, page_params = list(where), list(params)
+        after = decode_cursor(cursor)
+        if after is not None:
+            prio, created_at, row_id = -after[0], after[1], after[2]
+            page_where.append("(IFNULL(priority_score, 0) < ? OR (IFNULL(priority_score, 0) = ? AND "
+                              "(created_at > ? OR (created_at = ? AND id > ?))))")
+            page_params += [prio, prio, created_at, created_at, row_id]
+        sql = "SELECT * FROM cases"
+        if page_where:
+            sql += ' WHERE ' + ' AND '.join(page_where)
+        sql += " ORDER BY priority_score DESC, created_at, id LIMIT ?"
+        rows = [self._row(r) for r in self.conn.execute(sql, page_params + [limit + 1])]
+        page = rows[:limit]
+        next_cursor = None
+        if len(rows) > limit:
+            last = page[-1]
+            next_cursor = encode_cursor((-int(last['priority_score'] or 0), str(last['created_at']), int(last['id'])))
+        return {'cases': page, 'next_cursor': next_cursor, 'total': total, 'counts': counts}
+
+    def get_case_bundle(self, case_number):
+        # four indexed lookups in one read transaction, so they share a snapshot
+        conn = self.conn
+        cn = str(case_number)
+        own = not conn.in_transaction
+        if own:
+            conn.execute('BEGIN')
+        try:
+            case = conn.execute('SELECT * FROM "cases" WHERE case_number = ? ORDER BY id LIMIT 1', (cn,)).fetchone()
+            if case is None:
+                return None
+            rows = {t: [self._row(r) for r in conn.execute(f"SELECT * FROM {_quote(t)} WHERE case_number = ? ORDER BY {order}", (cn,))]
+                    for t, order in (('samples', 'id'), ('custody_events', 'timestamp, id'), ('lab_results', 'id'))}
+        finally:
+            if own:
+                conn.execute('COMMIT')
+        return {'case': self._row(case), 'samples': rows['samples'],
+                'events': rows['custody_events'], 'results': rows['lab_results']}
+
+    def chain_head(self, case_number):
+        r = self.conn.execute("SELECT hash, timestamp, count FROM custody_heads WHERE case_number = ?",
+                              (str(case_number),)).fetchone()
+        if r is None:
+            return None
+        return {'hash': r['hash'] or '', 'timestamp': r['timestamp'] or '', 'count': r['count']}
+
+    def last_event_hash(self, case_number):
+        head = self.chain_head(case_number)
+        return head['hash'] if head else ''
+
+    def last_event_hashes(self, case_numbers):
+        # {case_number: head hash} for many cases, '' for cases without events
+        keys = [str(cn) for cn in case_numbers]
+        found = {}
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            for r in self.conn.execute(f"SELECT case_number, hash FROM custody_heads WHERE case_number IN "
+                                       f"({', '.join('?' * len(part))})", part):
+                found[r['case_number']] = r['hash'] or ''
+        return {cn: found.get(cn, '') for cn in keys}
+
+    def _rebuild_heads(self):
+        self.conn.execute("DELETE FROM custody_heads")
+        self.conn.execute(
+            "INSERT INTO custody_heads (case_number, hash, timestamp, count) "
+            "SELECT case_number, hash, timestamp, n FROM ("
+            " SELECT case_number, hash, timestamp,"
+            " COUNT(*) OVER (PARTITION BY case_number) AS n,"
+            " ROW_NUMBER() OVER (PARTITION BY case_number ORDER BY timestamp DESC, id DESC) AS rn"
+            " FROM custody_events) WHERE rn = 1")
+
+    def rebuild_chain_index(self):
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._rebuild_heads()
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return conn.execute("SELECT COUNT(*) AS n FROM custody_heads").fetchone()['n']
+
+    def next_case_sequence(self):
+        r = self.conn.execute("SELECT MAX(id) AS m FROM cases").fetchone()
+        return int(r['m']) + 1 if r['m'] is not None else 1
+
+    def import_workbook(self, xlsx_path, replace=True):
+        # one-shot migration: copy every known sheet, keeping the original ids
+        sheets = pd.read_excel(xlsx_path, sheet_name=None, engine='openpyxl')
+        counts = {}
+        for table, cols in self.tables.items():
+            df = sheets.get(table)
+            if df is None:
+                continue
+            df = df[[c for c in cols if c in df.columns]]
+            if 'id' in df.columns:
+                df = df[pd.to_numeric(df['id'], errors='coerce').notna()]
+            if not replace and self.conn.execute(f"SELECT 1 FROM {_quote(table)} LIMIT 1").fetchone():
+                continue
+            self.replace_frame(table, df)
+            counts[table] = len(df)
+        return counts
+
+
+if __name__ == '__main__':
+    import argparse
+    from storage import TABLES
+    parser = argparse.ArgumentParser(description='Import the Excel workbook into a SQLite database')
+    parser.add_argument('workbook', help='path to forensic_cases.xlsx')
+    parser.add_argument('database', nargs='?', help='target .sqlite3 file (default: next to the workbook)')
+    parser.add_argument('--keep-existing', action='store_true', help='skip tables that already contain rows')
+    args = parser.parse_args()
+    db = args.database or os.path.splitext(args.workbook)[0] + '.sqlite3'
+    counts = SQLiteBackend(db, TABLES).import_workbook(args.workbook, replace=not args.keep_existing)
+    for table, n in counts.items():
+        print(f"{table}: {n} rows")
+    print("Imported into", db)
@@ -0,0 +1,54 @@
+# startup_report.py  (import-time profile of the web app, built on python -X importtime)
+# usage: python startup_report.py [--top N] [--storage]
+import re
+import subprocess
+import sys
+import os
+
+HEAVY = ('pandas', 'numpy', 'boto3', 'botocore', 'reportlab', 'openpyxl', 'pyarrow', 'qrcode', 'PIL')
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def importtime(stmt, cwd=None):
+    # [(self_us, cumulative_us, depth, module)] in the order python reports them
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', stmt],
+                          capture_output=True, text=True, cwd=cwd)
+    if proc.returncode != 0:
+        raise SystemExit(f"'{stmt}' failed:\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((int(m.group(1)), int(m.group(2)), (len(m.group(3)) - 1) // 2, m.group(4)))
+    return rows
+
+
+def summarize(rows, top=10):
+    total = sum(r[1] for r in rows if r[2] == 0)
+    heavy = {}
+    for name in HEAVY:
+        # a package's submodules can show up at top level when it was half imported
+        hits = [r[1] for r in rows if r[3] == name or r[3].startswith(name + '.')]
+        heavy[name] = max(hits) if hits else None
+    slowest = sorted((r for r in rows if r[2] == 0), key=lambda r: -r[1])[:top]
+    return total, heavy, slowest
+
+
+def report(label, stmt, top, cwd):
+    total, heavy, slowest = summarize(importtime(stmt, cwd), top)
+    print(f"== {label}: {total / 1000:.1f} ms in imports")
+    for _, cum, _, name in slowest:
+        print(f"   {cum / 1000:8.1f} ms  {name}")
+    print("   heavy modules: " + ', '.join(
+        f"{name} {'%.0f ms' % (us / 1000) if us is not None else 'deferred'}" for name, us in heavy.items()))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    top = int(args[args.index('--top') + 1]) if '--top' in args else 10
+    here = os.path.dirname(os.path.abspath(__file__))
+    report('import app', 'import app', top, here)
+    report('create_app()', 'import app; app.create_app()', top, here)
+    if '--storage' in args:
+        # what the first request that touches storage pays on top
+        report('first storage use', 'import app; app.create_app(); app.storage.all("users")', top, here)
@@ -1,42 +1,141 @@
-# storage.py  (S3/MinIO enabled Excel backend with file locking)
+# storage.py  (S3/MinIO enabled Excel backend with per-table reader/writer locks)
 import os
+import threading
 import pandas as pd
-from filelock import FileLock
 from datetime import datetime
-import boto3
-from botocore.exceptions import ClientError
 from urllib.parse import urlparse
 import io
+import time
+import heapq
+from collections import OrderedDict
+from contextlib import contextmanager
+from sqlite_backend import SQLiteBackend, INTEGER_COLUMNS
+from journal import Journal, apply_records, bulk_update_frame
+from s3sync import S3Uploader
+from utils import encode_cursor, decode_cursor, compute_priorities
+from custody import ChainIndex, MerkleTree, chain_order, verify_custody
+from rwlock import TableLocks
+from sequences import SequenceStore
+from schema import typed_frame, plain_frame, records, match_mask, isin_mask, concat_rows
+from metrics import STORAGE_CALLS, S3_TRANSFERS, instrument_methods
 
 TABLES = {
     'users': ['id','email','name','role','password_hash','api_token','created_at'],
-    'labs': ['id','name','contact_email','is_active','created_at'],
-    'cases': ['id','case_number','offence_type','description','priority_score','status','created_at','created_by','lab_assigned'],
+    'labs': ['id','name','contact_email','is_active','capacity','created_at'],
+    'cases': ['id','case_number','offence_type','description','priority_score','status','created_at','created_by','lab_assigned','suspect_in_custody'],
     'samples': ['id','case_number','code','qr_path','status','created_at'],
     'custody_events': ['id','case_number','sample_code','actor','action','timestamp','note','prev_hash','hash'],
     'lab_results': ['id','case_number','sample_code','lab_user','result_summary','result_file','created_at']
 }
 
+@contextmanager
+def _replacing(path):
+    # yields a temp path next to `path`; once written it is synced and swapped in
+    # with os.replace, so readers in any process see the old file or the new one
+    root, ext = os.path.splitext(path)
+    tmp = f"{root}.{os.getpid()}.{threading.get_ident()}.tmp{ext}"
+    try:
+        yield tmp
+        with open(tmp, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def _parquet_frame(df):
+    # Parquet needs one type per column: integer columns stay integers, the rest become strings
+    out = pd.DataFrame(index=df.index)
+    for c in df.columns:
+        col = df[c]
+        if c in INTEGER_COLUMNS:
+            col = col.map(lambda v: int(v) if isinstance(v, bool) else v)
+            out[c] = pd.to_numeric(col.replace('', None), errors='coerce').astype('Int64')
+        else:
+            out[c] = col.map(lambda v: '' if v is None or (isinstance(v, float) and pd.isna(v)) else str(v))
+    return out
+
+def _first_free_id(df):
+    if df.empty or 'id' not in df.columns:
+        return 1
+    maxid = pd.to_numeric(df['id'], errors='coerce').max()
+    return int(maxid) + 1 if not pd.isna(maxid) else 1
+
+def _find_in(df, kwargs):
+    if df.empty:
+        return None
+    mask = match_mask(df, kwargs)
+    if mask is None or not mask.any():
+        return None
+    return records(df[mask].iloc[:1])[0]
+
+def _find_many_in(df, field, values):
+    if df.empty or field not in df.columns:
+        return {}
+    found = {}
+    for row in records(df[isin_mask(df[field], values)]):
+        found.setdefault(str(row[field]), row)
+    return found
+
+def _filter_in(df, kwargs):
+    if df.empty:
+        return []
+    mask = match_mask(df, kwargs)
+    if mask is None:
+        return []
+    return records(df[mask])
+
 class Storage:
-    def __init__(self, file_path='instance/data/forensic_cases.xlsx', use_excel=True):
-        self.use_excel = use_excel
+    def __init__(self, file_path='instance/data/forensic_cases.xlsx', use_excel=True, backend=None):
+        # backend: 'excel', 'csv', 'parquet' or 'sqlite'; defaults to STORAGE_BACKEND, then use_excel
+        self.backend = backend or os.getenv('STORAGE_BACKEND', '') or ('excel' if use_excel else 'csv')
+        # S3_LAYOUT=tables keeps one Parquet object per table instead of one workbook
+        self.s3_layout = os.getenv('S3_LAYOUT', 'workbook') or 'workbook'
+        if self.s3_layout == 'tables' and self.backend != 'sqlite':
+            self.backend = 'parquet'
+        self.use_excel = self.backend == 'excel'
         self.xlsx_path = file_path
         self.data_dir = os.path.dirname(file_path)
         if self.data_dir:  # avoid empty string
             os.makedirs(self.data_dir, exist_ok=True)
-        self.lock_path = os.path.join(self.data_dir, 'data.lock') if self.data_dir else 'data.lock'
-        self.lock = FileLock(self.lock_path)
+        # reads take a table's lock shared, writes exclusive; see _lock_name()
+        self.locks = TableLocks(self.data_dir)
+        # ids come from a persisted sequence per table, reserved in blocks of
+        # ID_BLOCK_SIZE per worker; a table is scanned once to seed its sequence
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        self.sequences = SequenceStore(os.path.join(self.data_dir, f"{stem}.sequences.json"), self.locks,
+                                       seed=lambda t: _first_free_id(self._load(t)),
+                                       block=int(os.getenv('ID_BLOCK_SIZE','50') or 50))
+        # parsed tables keyed by table name -> (signature, DataFrame)
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._generations = {}
+        # bumped on every write this process makes, see table_version()
+        self._versions = {}
         # S3 config
         self.s3_enabled = bool(int(os.getenv('S3_ENABLED','0')))
         self.s3_bucket = os.getenv('S3_BUCKET','')
         self.s3_key = os.getenv('S3_WORKBOOK_KEY','fasttrack/data_workbook.xlsx')
         self.s3_endpoint = os.getenv('S3_ENDPOINT_URL','') or None
         self.s3_region = os.getenv('S3_REGION','us-east-1')
+        self.s3_table_prefix = os.getenv('S3_TABLE_PREFIX','') or 'fasttrack/tables/'
+        # conditional refresh: skip the GET entirely within this many seconds
+        # of the last check, and send If-None-Match otherwise; all keyed by local path
+        self.s3_refresh_interval = float(os.getenv('S3_REFRESH_INTERVAL','0') or 0)
+        self._s3_etags = {}
+        self._s3_last_modified = {}
+        self._s3_checked_at = {}
+        # uploads run on a background thread that coalesces bursts of writes;
+        # S3_UPLOAD_ASYNC=0 restores the synchronous put after every write
+        self.s3_async = bool(int(os.getenv('S3_UPLOAD_ASYNC','1')))
+        self.uploader = None
 
         # initialize s3 client if enabled
         if self.s3_enabled:
-            import boto3
-            from botocore.exceptions import ClientError
+            import boto3  # deferred: boto3/botocore only load when S3 is enabled
             session = boto3.session.Session()
             s3_params = {'region_name': self.s3_region}
             if self.s3_endpoint:
@@ -45,189 +144,885 @@ class Storage:
                                      aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
                                      aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
                                      **s3_params)
-            self._download_from_s3_if_exists()
+            if self.s3_async:
+                self.uploader = S3Uploader(self._upload_to_s3,
+                                           debounce=float(os.getenv('S3_UPLOAD_DEBOUNCE','2') or 2))
+            if self.s3_layout != 'tables':
+                # table objects are fetched lazily, one per read
+                self._download_from_s3_if_exists()
+
+        self.sql = None
+        if self.backend == 'sqlite':
+            self.sqlite_path = os.getenv('SQLITE_PATH', '') or os.path.splitext(file_path)[0] + '.sqlite3'
+            self.sql = SQLiteBackend(self.sqlite_path, TABLES)
+
+        # write-ahead journal: appends/updates go to per-table NDJSON files and
+        # are folded into the workbook by compact()
+        self.journal_enabled = bool(int(os.getenv('JOURNAL_ENABLED','0'))) and self.sql is None
+        self.journal_dir = os.path.join(self.data_dir, 'journal')
+        self._journals = {}
+        self._merged = {}
+        # per-case custody chain head, see chain_head(); stale once custody_events
+        # was replaced wholesale (S3 refresh, split_workbook)
+        self._chain = None
+        self._chain_stale = False
+        # merkle trees per case, reused while the case's events are unchanged
+        self._merkle = OrderedDict()
+        # table -> (frame, {case_number: row positions}), see get_case_bundle()
+        self._case_indexes = {}
 
         self._ensure_tables()
 
+        compact_interval = float(os.getenv('JOURNAL_COMPACT_INTERVAL','0') or 0)
+        if self.journal_enabled and compact_interval > 0:
+            self.start_compactor(compact_interval)
+
+        rescore_interval = float(os.getenv('PRIORITY_RESCORE_INTERVAL','0') or 0)
+        if rescore_interval > 0:
+            self.start_rescorer(rescore_interval)
+
+    def _s3_table_key(self, table):
+        return f"{self.s3_table_prefix}{table}.parquet"
+
+    def _local_etag(self, path):
+        # the sidecar is shared by every worker using the same local copy
+        etag = self._s3_etags.get(path)
+        if etag is None and os.path.exists(path):
+            try:
+                with open(path + '.etag') as f:
+                    etag = f.read().strip() or None
+            except OSError:
+                pass
+            self._s3_etags[path] = etag
+        return etag
+
+    def _remember_etag(self, path, etag, last_modified=None):
+        self._s3_etags[path] = etag
+        self._s3_last_modified[path] = last_modified
+        if etag:
+            tmp = path + '.etag.tmp'
+            with open(tmp, 'w') as f:
+                f.write(etag)
+            os.replace(tmp, path + '.etag')
 
-    def _download_from_s3_if_exists(self):
+    def _s3_fetch(self, key, path, force=False):
+        from botocore.exceptions import ClientError
+        now = time.monotonic()
+        if not force and self.s3_refresh_interval and now - self._s3_checked_at.get(path, 0.0) < self.s3_refresh_interval:
+            return False
+        self._s3_checked_at[path] = now
         try:
             # create data dir if missing
-            os.makedirs(self.data_dir, exist_ok=True)
-            # attempt get object
-            resp = self.s3.get_object(Bucket=self.s3_bucket, Key=self.s3_key)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            # attempt get object; unchanged objects answer 304 without a body
+            params = {'Bucket': self.s3_bucket, 'Key': key}
+            etag = None if force else self._local_etag(path)
+            if etag:
+                params['IfNoneMatch'] = etag
+            resp = self.s3.get_object(**params)
             body = resp['Body'].read()
-            with open(self.xlsx_path, 'wb') as f:
+            # replace atomically so readers never parse a half-written file
+            tmp = path + '.download'
+            with open(tmp, 'wb') as f:
                 f.write(body)
+            os.replace(tmp, path)
+            self._remember_etag(path, resp.get('ETag'), resp.get('LastModified'))
             # downloaded successfully
+            return True
         except ClientError as e:
-            # if not found, silence; workbook will be created locally on first write
+            # not modified: keep the local copy and its parsed cache
+            # if not found, silence; the file will be created locally on first write
             code = getattr(e, 'response', {}).get('Error', {}).get('Code', '')
-            if code in ('NoSuchKey', '404', 'NoSuchBucket'):
-                return
+            if code in ('304', 'NotModified', 'NoSuchKey', '404', 'NoSuchBucket'):
+                return False
             # other errors rethrow
             # print('S3 download error', e)
-            return
+            return False
+
+    def _download_from_s3_if_exists(self, force=False, table=None):
+        if self.s3_layout == 'tables':
+            tables = [table] if table else list(TABLES)
+            fetched = dict(zip(tables, (self._s3_fetch(self._s3_table_key(t), self._table_path(t), force)
+                                        for t in tables)))
+            if fetched.get('custody_events'):
+                self._chain_stale = True
+            return any(fetched.values())
+        fetched = self._s3_fetch(self.s3_key, self.xlsx_path, force)
+        if fetched:
+            self._chain_stale = True
+        return fetched
+
+    def _upload_to_s3(self, tables=None):
+        if not self.s3_enabled:
+            return False
+        if self.s3_layout == 'tables':
+            items = [(self._s3_table_key(t), self._table_path(t), t) for t in (tables or TABLES)]
+        else:
+            items = [(self.s3_key, self.xlsx_path, 'cases')]
+        ok = True
+        for key, path, table in items:
+            try:
+                # snapshot under a shared lock so the sidecar etag matches what was read
+                with self.locks.shared(self._lock_name(table)):
+                    with open(path, 'rb') as f:
+                        body = f.read()
+                resp = self.s3.put_object(Bucket=self.s3_bucket, Key=key, Body=body)
+                # the local file is now the current object, so don't fetch it back
+                self._remember_etag(path, resp.get('ETag'))
+            except Exception as e:
+                # best-effort: log to stdout so Render shows it
+                print("S3 upload failed:", e)
+                ok = False
+        return ok
 
-    def _upload_to_s3(self):
+    def _schedule_upload(self, tables=None):
         if not self.s3_enabled:
             return
-        try:
-            with open(self.xlsx_path, 'rb') as f:
-                self.s3.put_object(Bucket=self.s3_bucket, Key=self.s3_key, Body=f.read())
-        except Exception as e:
-            # best-effort: log to stdout so Render shows it
-            print("S3 upload failed:", e)
+        if self.uploader is not None:
+            if self.s3_layout == 'tables':
+                for t in (tables or TABLES):
+                    self.uploader.mark_dirty(t)
+            else:
+                self.uploader.mark_dirty()
+        else:
+            self._upload_to_s3(tables)
+
+    def flush_uploads(self, timeout=30.0):
+        # block until every write so far has reached S3 (used on shutdown)
+        if self.uploader is None:
+            return True
+        return self.uploader.flush(timeout)
+
+    def upload_stats(self):
+        if self.uploader is None:
+            return {'pending': 0, 'uploaded': 0, 'failed': 0, 'coalesced': 0}
+        return self.uploader.stats()
 
     def _ensure_tables(self):
+        if self.sql is not None:
+            return  # schema is created by SQLiteBackend
         if self.use_excel:
             if not os.path.exists(self.xlsx_path):
-                with pd.ExcelWriter(self.xlsx_path, engine='openpyxl') as writer:
+                with _replacing(self.xlsx_path) as tmp, pd.ExcelWriter(tmp, engine='openpyxl') as writer:
                     for t, cols in TABLES.items():
                         df = pd.DataFrame(columns=cols)
                         df.to_excel(writer, sheet_name=t, index=False)
                 # if s3 enabled, upload initial workbook
                 if self.s3_enabled:
                     self._upload_to_s3()
+        elif self.backend == 'parquet':
+            created = []
+            for t, cols in TABLES.items():
+                path = self._table_path(t)
+                if not os.path.exists(path) and self.s3_enabled and self.s3_layout == 'tables':
+                    self._download_from_s3_if_exists(table=t)
+                if not os.path.exists(path):
+                    with _replacing(path) as tmp:
+                        _parquet_frame(pd.DataFrame(columns=cols)).to_parquet(tmp, index=False)
+                    created.append(t)
+            if created and self.s3_enabled:
+                self._upload_to_s3(created)
         else:
             for t, cols in TABLES.items():
                 path = os.path.join(self.data_dir, f"{t}.csv")
                 if not os.path.exists(path):
-                    df = pd.DataFrame(columns=cols)
-                    df.to_csv(path, index=False)
+                    with _replacing(path) as tmp:
+                        pd.DataFrame(columns=cols).to_csv(tmp, index=False)
+
+    def _file_signature(self, path):
+        # mtime/size/inode change whenever any worker rewrites the file;
+        # the generation covers writes from this process within one mtime tick
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (self._generations.get(path, 0), st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _lock_name(self, table):
+        # the workbook is one file, so every table shares its lock there
+        return 'data' if self.use_excel else table
+
+    def _table_path(self, table):
+        if self.use_excel:
+            return self.xlsx_path
+        if self.backend == 'parquet':
+            return os.path.join(self.data_dir, f"{table}.parquet")
+        return os.path.join(self.data_dir, f"{table}.csv")
+
+    def invalidate_cache(self, table=None):
+        self._touched(TABLES if table is None else [table])
+        with self._cache_lock:
+            if table is None:
+                paths = {self._table_path(t) for t in TABLES}
+            else:
+                paths = {self._table_path(table)}
+            for path in paths:
+                self._generations[path] = self._generations.get(path, 0) + 1
+            for t in list(self._cache):
+                if self._table_path(t) in paths:
+                    del self._cache[t]
+            for t in list(self._merged):
+                if self._table_path(t) in paths:
+                    del self._merged[t]
+
+    def _touched(self, tables):
+        with self._cache_lock:
+            for t in tables:
+                self._versions[t] = self._versions.get(t, 0) + 1
+
+    def table_version(self, table):
+        # changes whenever this process writes the table; in-process caches built
+        # on top of a table compare it to know when to rebuild
+        return self._versions.get(table, 0)
+
+    def _cached(self, table, sig):
+        if sig is None:
+            return None
+        with self._cache_lock:
+            entry = self._cache.get(table)
+        if entry is not None and entry[0] == sig:
+            return entry[1]
+        return None
 
     def _read(self, table):
         # if S3 enabled, refresh local copy before read
-        if self.s3_enabled:
+        # local writes that are still queued for upload win over the remote copy;
+        # in the per-table layout only the object for this table is checked
+        key = table if self.s3_layout == 'tables' else None
+        if self.s3_enabled and not (self.uploader and self.uploader.has_pending(key)):
             # try to download fresh copy (non-blocking)
             try:
-                self._download_from_s3_if_exists()
+                self._download_from_s3_if_exists(table=key)
             except Exception:
                 pass
+        return self._load(table)
+
+    def _journal(self, table):
+        j = self._journals.get(table)
+        if j is None:
+            stem = os.path.splitext(os.path.basename(self.xlsx_path))[0]
+            j = Journal(os.path.join(self.journal_dir, f"{stem}.{table}.ndjson"))
+            self._journals[table] = j
+        return j
+
+    def _load(self, table):
+        if self.sql is not None:
+            return self.sql.read_frame(table)
+        if not self.journal_enabled:
+            return self._load_base(table)
+        # base table plus journal, read under a shared lock so a compaction
+        # can't swap the base file and reset the journal between the two
+        with self.locks.shared(self._lock_name(table)):
+            return self._load_merged(table)
+
+    def _load_merged(self, table):
+        # only the journal tail written since the last read is replayed while
+        # the base file is unchanged
+        base_sig = self._file_signature(self._table_path(table))
+        base = self._load_base(table)
+        j = self._journal(table)
+        ino, size = j.identity()
+        with self._cache_lock:
+            entry = self._merged.get(table)
+        if entry is not None and base_sig is not None and entry[0] == base_sig and entry[1] == ino:
+            if entry[2] == size:
+                return entry[3]
+            tail, offset = j.read_from(entry[2])
+            df = apply_records(entry[3], tail, append=concat_rows)
+        else:
+            tail, offset = j.read_from(0)
+            df = apply_records(base, tail, append=concat_rows)
+        if tail:
+            # updates are replayed as plain values into object columns
+            df = typed_frame(df, [c for c in df.columns if df[c].dtype == object])
+        with self._cache_lock:
+            self._merged[table] = (base_sig, ino, offset, df)
+        return df
+
+    def _load_base(self, table):
+        # returned frames are shared through the cache: treat them as read-only.
+        # A cache hit needs no lock; a parse runs under the table's shared lock.
+        # The signature is taken before parsing so a concurrent S3 refresh can only
+        # make the cached copy look stale, never make stale data look fresh.
+        path = self._table_path(table)
+        df = self._cached(table, self._file_signature(path))
+        if df is not None:
+            return df
+        with self.locks.shared(self._lock_name(table)):
+            return self._parse_base(table, path)
+
+    def _parse_base(self, table, path):
+        sig = self._file_signature(path)
+        df = self._cached(table, sig)
+        if df is not None:
+            return df
+        # writes are atomic, so a file that exists always parses; errors propagate
+        # rather than handing a writer an empty table to save back
+        if sig is None:
+            return pd.DataFrame(columns=TABLES[table])
         if self.use_excel:
-            try:
-                df = pd.read_excel(self.xlsx_path, sheet_name=table, engine='openpyxl')
-                return df.fillna('')
-            except Exception:
+            # the whole workbook changes on every write, so parse all
+            # sheets in one pass and cache them under the same signature
+            sheets = pd.read_excel(self.xlsx_path, sheet_name=None, engine='openpyxl')
+            parsed = {t: typed_frame(d.fillna('')) for t, d in sheets.items()}
+            with self._cache_lock:
+                for t, d in parsed.items():
+                    self._cache[t] = (sig, d)
+            if table not in parsed:
                 return pd.DataFrame(columns=TABLES[table])
+            return parsed[table]
+        if self.backend == 'parquet':
+            df = pd.read_parquet(path)
+            df = typed_frame(df.astype(object).where(df.notna(), ''))
         else:
-            path = os.path.join(self.data_dir, f"{table}.csv")
-            try:
-                df = pd.read_csv(path, dtype=str)
-                return df.fillna('')
-            except Exception:
-                return pd.DataFrame(columns=TABLES[table])
+            df = typed_frame(pd.read_csv(path, dtype=str).fillna(''))
+        with self._cache_lock:
+            self._cache[table] = (sig, df)
+        return df
 
     def _write(self, table, df):
-        with self.lock:
+        self._write_tables({table: df})
+
+    def _write_tables(self, frames):
+        if self.sql is not None:
+            for table, df in frames.items():
+                self.sql.replace_frame(table, plain_frame(df))
+            return
+        with self.locks.exclusive(*(self._lock_name(t) for t in frames)):
             if self.use_excel:
-                with pd.ExcelWriter(self.xlsx_path, engine='openpyxl') as writer:
-                    # preserve other sheets by reading them first
-                    existing = {}
-                    try:
-                        if os.path.exists(self.xlsx_path):
-                            for t in TABLES.keys():
-                                if t == table:
-                                    continue
-                                try:
-                                    other = pd.read_excel(self.xlsx_path, sheet_name=t, engine='openpyxl')
-                                except Exception:
-                                    other = pd.DataFrame(columns=TABLES[t])
-                                existing[t] = other
-                    except Exception:
-                        existing = {}
-                    # write target
-                    df.to_excel(writer, sheet_name=table, index=False)
-                    # write preserved sheets
-                    for t, other in existing.items():
-                        other.to_excel(writer, sheet_name=t, index=False)
-                # after local write, upload to S3 (if enabled)
-                if self.s3_enabled:
-                    self._upload_to_s3()
+                # the other sheets are carried over from the current workbook
+                existing = {}
+                if os.path.exists(self.xlsx_path):
+                    for t in TABLES.keys():
+                        if t not in frames:
+                            existing[t] = self._load_base(t)
+                with _replacing(self.xlsx_path) as tmp, pd.ExcelWriter(tmp, engine='openpyxl') as writer:
+                    for t in TABLES.keys():
+                        other = frames[t] if t in frames else existing.get(t, pd.DataFrame(columns=TABLES[t]))
+                        plain_frame(other).to_excel(writer, sheet_name=t, index=False)
+            elif self.backend == 'parquet':
+                for table, df in frames.items():
+                    with _replacing(self._table_path(table)) as tmp:
+                        _parquet_frame(plain_frame(df)).to_parquet(tmp, index=False)
             else:
-                path = os.path.join(self.data_dir, f"{table}.csv")
-                df.to_csv(path, index=False)
+                for table, df in frames.items():
+                    with _replacing(self._table_path(table)) as tmp:
+                        plain_frame(df).to_csv(tmp, index=False)
+            # the written frames already include anything journaled for them
+            if self.journal_enabled:
+                for table in frames:
+                    self._journal(table).reset()
+            for table in frames:
+                self.invalidate_cache(table)
+            # after local write, queue an upload to S3 (if enabled); the
+            # per-table layout only uploads the tables that were written
+            if self.use_excel:
+                self._schedule_upload()
+            elif self.backend == 'parquet' and self.s3_layout == 'tables':
+                self._schedule_upload(list(frames))
+
+    def compact(self):
+        # fold every non-empty journal into the base files in a single write
+        if not self.journal_enabled:
+            return 0
+        with self.locks.exclusive(*(self._lock_name(t) for t in TABLES)):
+            pending = [t for t in TABLES if not self._journal(t).is_empty()]
+            if not pending:
+                return 0
+            self._write_tables({t: self._load(t) for t in pending})
+        return len(pending)
+
+    def start_compactor(self, interval):
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.compact()
+                except Exception as e:
+                    print("Journal compaction failed:", e)
+        t = threading.Thread(target=loop, name='journal-compactor', daemon=True)
+        t.start()
+        return t
 
     def all(self, table):
+        if self.sql is not None:
+            return self.sql.all(table)
         df = self._read(table)
-        return df.to_dict(orient='records')
+        return records(df)
 
     def find(self, table, **kwargs):
-        df = self._read(table)
-        if df.empty:
-            return None
-        mask = pd.Series([True] * len(df))
-        for k, v in kwargs.items():
-            if k in df.columns:
-                mask = mask & (df[k].astype(str) == str(v))
-            else:
-                return None
-        res = df[mask]
-        if res.empty:
-            return None
-        return res.iloc[0].to_dict()
+        if self.sql is not None:
+            return self.sql.find(table, **kwargs)
+        return _find_in(self._read(table), kwargs)
+
+    def find_many(self, table, field, values):
+        # {str(value): first row whose field equals it} for many values, one read
+        if self.sql is not None:
+            return self.sql.find_many(table, field, values)
+        return _find_many_in(self._read(table), field, values)
 
     def filter(self, table, **kwargs):
-        df = self._read(table)
-        if df.empty:
-            return []
-        mask = pd.Series([True] * len(df))
-        for k, v in kwargs.items():
-            if k in df.columns:
-                mask = mask & (df[k].astype(str) == str(v))
-            else:
-                return []
-        res = df[mask]
-        return res.to_dict(orient='records')
+        if self.sql is not None:
+            return self.sql.filter(table, **kwargs)
+        return _filter_in(self._read(table), kwargs)
 
-    def append(self, table, row: dict):
-        df = self._read(table)
-        new = row.copy()
-        # id assignment
-        if 'id' in TABLES[table]:
-            if df.empty:
-                new_id = 1
-            else:
-                try:
-                    maxid = pd.to_numeric(df['id'], errors='coerce').max()
-                    new_id = int(maxid) + 1 if not pd.isna(maxid) else 1
-                except Exception:
-                    new_id = len(df) + 1
-            new['id'] = new_id
+    @contextmanager
+    def transaction(self, *tables):
+        # holds the named tables' locks exclusive for the whole unit of work (all
+        # tables when none are named); tables are loaded once on first use and
+        # every change is written (and uploaded) once on exit.
+        # An exception inside the block discards all changes.
+        if self.sql is not None:
+            # the backend does not report which tables a transaction wrote
+            try:
+                with self.sql.transaction():
+                    yield self.sql
+            finally:
+                self._touched(TABLES)
+            return
+        tables = tables or tuple(TABLES)
+        with self.locks.exclusive(*(self._lock_name(t) for t in tables)):
+            tx = Transaction(self, tables)
+            yield tx
+            tx.commit()
+
+    def split_workbook(self, xlsx_path=None):
+        # migration to the per-table layout: one local file and one object per table
+        if self.backend != 'parquet':
+            raise ValueError("split_workbook needs the per-table layout (S3_LAYOUT=tables)")
+        if xlsx_path is None:
+            if not self.s3_enabled:
+                raise ValueError("no workbook given and S3 is not enabled")
+            # default to the workbook object the single-object layout used
+            xlsx_path = os.path.join(self.data_dir, 'workbook.migrate.xlsx')
+            self._s3_fetch(self.s3_key, xlsx_path, force=True)
+        sheets = pd.read_excel(xlsx_path, sheet_name=None, engine='openpyxl')
+        frames = {t: sheets[t].fillna('') for t in TABLES if t in sheets}
+        self._write_tables(frames)
+        for t, df in frames.items():
+            self.sequences.resync(t, _first_free_id(df))
+        self.rebuild_chain_index()
+        self.flush_uploads()
+        return {t: len(df) for t, df in frames.items()}
+
+    def _new_row(self, table, row):
+        return self._new_rows(table, [row])[0]
+
+    def _new_rows(self, table, rows):
+        # callers hold the table's exclusive lock; a batch gets consecutive ids
+        news = [row.copy() for row in rows]
+        if 'id' in TABLES[table] and news:
+            new_id = self.sequences.take(table, len(news))
+            for i, new in enumerate(news):
+                new['id'] = new_id + i
         # timestamps
-        if 'created_at' in TABLES[table] and 'created_at' not in new:
-            new['created_at'] = datetime.utcnow().isoformat()
-        df = pd.concat([df, pd.DataFrame([new])], ignore_index=True, sort=False)
-        self._write(table, df)
+        if 'created_at' in TABLES[table]:
+            now = datetime.utcnow().isoformat()
+            for new in news:
+                if 'created_at' not in new:
+                    new['created_at'] = now
+        return news
+
+    def append(self, table, row: dict):
+        if self.sql is not None:
+            new = self.sql.append(table, row)
+            self._touched([table])
+            return new
+        if self.journal_enabled:
+            # the id comes from the sequence, so only the custody index needs the table
+            with self.locks.exclusive(self._lock_name(table)):
+                total = len(self._load(table)) if table == 'custody_events' else None
+                new = self._new_row(table, row)
+                self._journal(table).append([{'op': 'append', 'row': new}])
+                self._touched([table])
+                if total is not None:
+                    self._record_custody(total, [new])
+            return new
+        # read-modify-write under one exclusive hold, so no other writer slips in between
+        with self.locks.exclusive(self._lock_name(table)):
+            df = self._read(table)
+            new = self._new_row(table, row)
+            self._write(table, concat_rows(df, [new]))
+            if table == 'custody_events':
+                self._record_custody(len(df), [new])
         return new
 
-    def update(self, table, id_field, id_value, updates: dict):
-        df = self._read(table)
+    def _updated_frame(self, df, id_field, id_value, updates):
+        # returns a modified copy, or None when nothing matches
         if id_field not in df.columns:
-            return False
-        mask = df[id_field].astype(str) == str(id_value)
+            return None
+        mask = match_mask(df, {id_field: id_value})
         if not mask.any():
-            return False
+            return None
+        df = df.copy()
         for k, v in updates.items():
             if k not in df.columns:
                 df[k] = ''
+            # typed columns may not hold the new value as-is; retyped below
+            df[k] = df[k].astype(object)
             df.loc[mask, k] = v
-        self._write(table, df)
+        return typed_frame(df, list(updates))
+
+    def update(self, table, id_field, id_value, updates: dict):
+        if self.sql is not None:
+            ok = self.sql.update(table, id_field, id_value, updates)
+            self._touched([table])
+            return ok
+        if self.journal_enabled:
+            with self.locks.exclusive(self._lock_name(table)):
+                df = self._load(table)
+                if id_field not in df.columns:
+                    return False
+                if not match_mask(df, {id_field: id_value}).any():
+                    return False
+                self._journal(table).append([{'op': 'update', 'field': id_field, 'value': id_value, 'updates': updates}])
+                self._touched([table])
+            return True
+        # cached frames are shared between callers, so this works on a copy
+        with self.locks.exclusive(self._lock_name(table)):
+            df = self._updated_frame(self._read(table), id_field, id_value, updates)
+            if df is None:
+                return False
+            self._write(table, df)
         return True
 
-    def last_event_hash(self, case_number):
-        events = self.filter('custody_events', case_number=case_number)
-        if not events:
-            return ''
-        events_sorted = sorted(events, key=lambda e: e.get('timestamp',''))
-        return events_sorted[-1].get('hash','')
+    def bulk_update(self, table, id_field, rows):
+        # many single-row updates as one write: rows are dicts that each carry
+        # id_field plus the columns to change. Returns the number of rows matched
+        if not rows:
+            return 0
+        if self.sql is not None:
+            n = self.sql.bulk_update(table, id_field, rows)
+            self._touched([table])
+            return n
+        with self.locks.exclusive(self._lock_name(table)):
+            if self.journal_enabled:
+                df = self._load(table)
+                _, n = bulk_update_frame(df, id_field, rows)
+                if n:
+                    self._journal(table).append([{'op': 'bulk_update', 'field': id_field, 'rows': rows}])
+                    self._touched([table])
+                return n
+            df, n = bulk_update_frame(self._read(table), id_field, rows)
+            if n:
+                self._write(table, df)
+            return n
 
-    def next_case_sequence(self):
+    def rescore_cases(self, now=None):
+        # recompute priority_score for every open case (age bonus grows with time)
+        # and write the ones that changed in a single bulk update
+        with self.locks.exclusive(self._lock_name('cases')):
+            df = self.sql.read_frame('cases') if self.sql is not None else self._read('cases')
+            if df.empty:
+                return 0
+            df = df[df['status'].astype(str) != 'completed']
+            # cases from before suspect_in_custody existed have it blank; their
+            # score may carry the custody bonus, which a rescore can't tell, so
+            # they keep the score they have
+            if 'suspect_in_custody' not in df.columns:
+                return 0
+            flag = df['suspect_in_custody'].astype(str).str.strip().str.lower()
+            df = df[flag.isin(['0', '1', 'true', 'false', 'yes', 'no', 'on', 'off'])]
+            if df.empty:
+                return 0
+            scores = compute_priorities(df, now)
+            current = pd.to_numeric(df['priority_score'], errors='coerce').fillna(-1).astype(int)
+            changed = scores != current
+            rows = [{'id': int(i), 'priority_score': int(p)}
+                    for i, p in zip(df.loc[changed, 'id'], scores[changed])]
+            return self.bulk_update('cases', 'id', rows)
+
+    def start_rescorer(self, interval):
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.rescore_cases()
+                except Exception as e:
+                    print("Priority re-scoring failed:", e)
+        t = threading.Thread(target=loop, name='priority-rescorer', daemon=True)
+        t.start()
+        return t
+
+    def _chain_index(self):
+        if self._chain is None:
+            stem = os.path.splitext(os.path.basename(self.xlsx_path))[0]
+            self._chain = ChainIndex(os.path.join(self.data_dir, f"{stem}.custody_heads.ndjson"))
+        if not self._chain.exists():
+            with self.locks.exclusive(self._lock_name('custody_events')):
+                if not self._chain.exists():
+                    self._chain.rebuild(self._custody_frame())
+        return self._chain
+
+    def _custody_frame(self):
+        # the index keeps timestamps as written, so hand it the plain columns
+        return plain_frame(self._load('custody_events'), ['case_number', 'timestamp', 'hash'])
+
+    def _record_custody(self, total_before, events):
+        # called under the custody_events lock after rows were written; an index
+        # that missed a write (crash, out-of-band edit) is rebuilt instead
+        idx = self._chain_index()
+        idx.refresh()
+        if self._chain_stale or idx.total != total_before:
+            self._chain_stale = False
+            idx.rebuild(self._custody_frame())
+        else:
+            idx.record(events)
+
+    def _synced_chain(self, total=None):
+        # the head index, rebuilt when it is out of step with custody_events: a
+        # replaced table, or an event count other than `total` (the caller's view)
+        # or, without one, the table's current row count
+        idx = self._chain_index()
+        idx.refresh()
+        if self._chain_stale or idx.total != (len(self._read('custody_events')) if total is None else total):
+            with self.locks.exclusive(self._lock_name('custody_events')):
+                idx.refresh()
+                if total is None:
+                    total = len(self._load('custody_events'))
+                if self._chain_stale or idx.total != total:
+                    self._chain_stale = False
+                    idx.rebuild(self._custody_frame())
+        return idx
+
+    def chain_head(self, case_number, total=None):
+        # {'hash', 'timestamp', 'count'} of the newest event for a case, or None.
+        # total: row count the caller saw in custody_events; a mismatch forces a rebuild
+        if self.sql is not None:
+            return self.sql.chain_head(case_number)
+        return self._synced_chain(total).heads.get(str(case_number))
+
+    def chain_heads(self, case_numbers, total=None):
+        # chain_head() for many cases with a single index refresh
+        if self.sql is not None:
+            return {str(cn): self.sql.chain_head(cn) for cn in case_numbers}
+        idx = self._synced_chain(total)
+        return {str(cn): idx.heads.get(str(cn)) for cn in case_numbers}
+
+    def rebuild_chain_index(self):
+        if self.sql is not None:
+            return self.sql.rebuild_chain_index()
+        with self.locks.exclusive(self._lock_name('custody_events')):
+            if self._chain is None:
+                self._chain_index()
+            self._chain_stale = False
+            return self._chain.rebuild(self._custody_frame())
+
+    def verify_custody(self, full=False, workers=None):
+        # checkpoints are HMAC-signed with CUSTODY_CHECKPOINT_KEY (or SECRET_KEY)
+        stem = os.path.splitext(os.path.basename(self.xlsx_path))[0]
+        path = os.path.join(self.data_dir, f"{stem}.custody_checkpoint.json")
+        key = os.getenv('CUSTODY_CHECKPOINT_KEY', '') or os.getenv('SECRET_KEY', 'dev')
+        return verify_custody(self.all('custody_events'), path, key, full=full, workers=workers)
+
+    def query_cases(self, limit=200, cursor=None, status=None, lab=None):
+        # one page of cases ordered by priority_score desc, created_at, id; the
+        # cursor is opaque and resumes after the last row of the previous page
+        if self.sql is not None:
+            return self.sql.query_cases(limit=limit, cursor=cursor, status=status, lab=lab)
         df = self._read('cases')
         if df.empty:
-            return 1
-        try:
-            maxid = pd.to_numeric(df['id'], errors='coerce').max()
-            return int(maxid) + 1
-        except Exception:
-            return len(df) + 1
+            return {'cases': [], 'next_cursor': None, 'total': 0, 'counts': {}}
+        if lab:
+            df = df[match_mask(df, {'lab_assigned': lab})]
+        counts = {str(k): int(v) for k, v in df['status'].value_counts().items() if v}
+        if status:
+            df = df[match_mask(df, {'status': status})]
+        prio = pd.to_numeric(df['priority_score'], errors='coerce').fillna(0).astype(int)
+        # the cursor carries created_at as text, the same on every backend
+        created = plain_frame(df, ['created_at'])['created_at']
+        keys = zip((-prio).tolist(), created.tolist(),
+                   pd.to_numeric(df['id'], errors='coerce').fillna(0).astype(int).tolist(), range(len(df)))
+        after = decode_cursor(cursor)
+        if after is not None:
+            keys = (k for k in keys if k[:3] > after)
+        # heap-based top-k: O(n log k) instead of sorting every case
+        top = heapq.nsmallest(limit + 1, keys)
+        page = top[:limit]
+        rows = records(df.iloc[[k[3] for k in page]])
+        next_cursor = encode_cursor(page[-1][:3]) if len(top) > limit else None
+        return {'cases': rows, 'next_cursor': next_cursor, 'total': len(df), 'counts': counts}
+
+    def _case_index(self, table, df):
+        # case_number -> row positions, built once per loaded frame; every write
+        # produces a new frame, so identity tells when the index is stale
+        entry = self._case_indexes.get(table)
+        if entry is None or entry[0] is not df:
+            index = df.groupby('case_number', sort=False).indices if len(df) and 'case_number' in df.columns else {}
+            entry = (df, index)
+            with self._cache_lock:
+                self._case_indexes[table] = entry
+        return entry[1]
+
+    def get_case_bundle(self, case_number):
+        # {'case', 'samples', 'events' (chain order), 'results'} for one case, or
+        # None if it doesn't exist. The four tables are read under one shared hold,
+        # so a concurrent write can't land between them
+        if self.sql is not None:
+            return self.sql.get_case_bundle(case_number)
+        cn = str(case_number)
+        tables = ('cases', 'samples', 'custody_events', 'lab_results')
+        rows = {}
+        with self.locks.shared(*(self._lock_name(t) for t in tables)):
+            for t in tables:
+                df = self._read(t)
+                pos = self._case_index(t, df).get(cn)
+                rows[t] = records(df.iloc[pos]) if pos is not None else []
+                if t == 'cases' and not rows[t]:
+                    return None
+        return {'case': rows['cases'][0], 'samples': rows['samples'],
+                'events': chain_order(rows['custody_events']), 'results': rows['lab_results']}
+
+    def custody_proof(self, case_number, event_id=None, sample_code=None, event_hash=None):
+        # O(log n) inclusion proof for one event of a case, or None if not found
+        case_number = str(case_number)
+        # keyed on the case's events as read now, not on the head index, so a
+        # stale index can't pin an old tree
+        events = chain_order(self.filter('custody_events', case_number=case_number))
+        if not events:
+            return None
+        key = (len(events), events[-1].get('hash', ''))
+        # the LRU is shared by request threads; the tree is built outside the lock
+        with self._cache_lock:
+            cached = self._merkle.get(case_number)
+            if cached is not None and cached[0] == key:
+                self._merkle.move_to_end(case_number)
+        if cached is None or cached[0] != key:
+            cached = (key, events, MerkleTree([e.get('hash', '') for e in events]))
+            with self._cache_lock:
+                self._merkle[case_number] = cached
+                self._merkle.move_to_end(case_number)
+                while len(self._merkle) > 256:
+                    self._merkle.popitem(last=False)
+        _, events, tree = cached
+        for index, ev in enumerate(events):
+            if ((event_id is not None and str(ev.get('id')) == str(event_id))
+                    or (sample_code is not None and ev.get('sample_code') == sample_code)
+                    or (event_hash is not None and ev.get('hash') == event_hash)):
+                return {'case_number': case_number, 'event_id': ev.get('id'), 'event_hash': ev.get('hash', ''),
+                        'index': index, 'size': tree.size, 'root': tree.root, 'proof': tree.proof(index)}
+        return None
+
+    def last_event_hash(self, case_number):
+        if self.sql is not None:
+            return self.sql.last_event_hash(case_number)
+        head = self.chain_head(case_number)
+        return head['hash'] if head else ''
+
+    def next_case_sequence(self):
+        if self.sql is not None:
+            return self.sql.next_case_sequence()
+        return self.sequences.peek('cases')
+
+class Transaction:
+    # in-memory unit of work used by Storage.transaction(); same read/write API as Storage
+    def __init__(self, storage, tables=None):
+        self.storage = storage
+        self.tables = set(tables or TABLES)
+        self.frames = {}
+        self.records = {}
+        self.base_len = {}
+        self.heads = {}
+
+    def _frame(self, table):
+        if table not in self.tables:
+            raise ValueError(f"table '{table}' was not named when the transaction started")
+        if table not in self.frames:
+            self.frames[table] = self.storage._read(table)
+            self.base_len[table] = len(self.frames[table])
+        return self.frames[table]
+
+    def all(self, table):
+        return records(self._frame(table))
+
+    def find(self, table, **kwargs):
+        return _find_in(self._frame(table), kwargs)
+
+    def find_many(self, table, field, values):
+        return _find_many_in(self._frame(table), field, values)
+
+    def filter(self, table, **kwargs):
+        return _filter_in(self._frame(table), kwargs)
+
+    def append(self, table, row: dict):
+        df = self._frame(table)
+        new = self.storage._new_row(table, row)
+        self.frames[table] = concat_rows(df, [new])
+        self.records.setdefault(table, []).append({'op': 'append', 'row': new})
+        if table == 'custody_events':
+            self.heads[str(new.get('case_number', ''))] = new.get('hash', '')
+        return new
+
+    def append_many(self, table, rows):
+        # one concat for the whole batch instead of one per row
+        if not rows:
+            return []
+        df = self._frame(table)
+        news = self.storage._new_rows(table, rows)
+        self.frames[table] = concat_rows(df, news)
+        self.records.setdefault(table, []).extend({'op': 'append', 'row': new} for new in news)
+        if table == 'custody_events':
+            for new in news:
+                self.heads[str(new.get('case_number', ''))] = new.get('hash', '')
+        return news
+
+    def update(self, table, id_field, id_value, updates: dict):
+        df = self.storage._updated_frame(self._frame(table), id_field, id_value, updates)
+        if df is None:
+            return False
+        self.frames[table] = df
+        self.records.setdefault(table, []).append(
+            {'op': 'update', 'field': id_field, 'value': id_value, 'updates': updates})
+        return True
+
+    def bulk_update(self, table, id_field, rows):
+        df, n = bulk_update_frame(self._frame(table), id_field, rows)
+        if n:
+            self.frames[table] = typed_frame(df, list(df.columns))
+            self.records.setdefault(table, []).append({'op': 'bulk_update', 'field': id_field, 'rows': rows})
+        return n
+
+    def last_event_hash(self, case_number):
+        # events appended in this transaction are the newest; otherwise use the index
+        if str(case_number) in self.heads:
+            return self.heads[str(case_number)]
+        self._frame('custody_events')
+        head = self.storage.chain_head(case_number, total=self.base_len['custody_events'])
+        return head['hash'] if head else ''
+
+    def last_event_hashes(self, case_numbers):
+        # last_event_hash() for many cases, with one chain index refresh
+        self._frame('custody_events')
+        keys = [str(cn) for cn in case_numbers]
+        heads = self.storage.chain_heads([cn for cn in keys if cn not in self.heads],
+                                         total=self.base_len['custody_events'])
+        return {cn: self.heads[cn] if cn in self.heads else (heads.get(cn) or {}).get('hash', '') for cn in keys}
+
+    def next_case_sequence(self):
+        return self.storage.sequences.peek('cases')
+
+    def commit(self):
+        if not self.records:
+            return
+        if self.storage.journal_enabled:
+            for table, recs in self.records.items():
+                self.storage._journal(table).append(recs)
+            self.storage._touched(self.records)
+        else:
+            self.storage._write_tables({t: self.frames[t] for t in self.records})
+        if 'custody_events' in self.records:
+            events = [r['row'] for r in self.records['custody_events'] if r['op'] == 'append']
+            if events:
+                self.storage._record_custody(self.base_len['custody_events'], events)
+        self.records = {}
+
+
+# ---------- instrumentation ----------
+# every public Storage method plus the workbook/table parse; transaction() is a
+# generator-based context manager, so its cost shows up as transaction_commit
+instrument_methods(Storage, STORAGE_CALLS, sorted(
+    name for name, fn in vars(Storage).items()
+    if callable(fn) and not name.startswith(('_', 'start_')) and name != 'transaction') + ['_load_base'])
+Transaction.commit = STORAGE_CALLS.time(method='transaction_commit')(Transaction.commit)
+Storage._download_from_s3_if_exists = S3_TRANSFERS.time(op='download')(Storage._download_from_s3_if_exists)
+Storage._upload_to_s3 = S3_TRANSFERS.time(op='upload')(Storage._upload_to_s3)
@@ -0,0 +1,55 @@
+# usercache.py  (in-memory users index for session and API token lookups)
+import hashlib
+import threading
+import time
+
+
+def token_digest(token):
+    return hashlib.sha256(str(token).encode('utf-8')).hexdigest()
+
+
+class UserCache:
+    # The users table indexed by id, email and sha256(api_token), built in one
+    # pass. It is rebuilt when this process writes users (Storage.table_version)
+    # or once ttl seconds have passed, which bounds how long a change made by
+    # another worker (new user, revoked token) can go unseen here.
+    def __init__(self, storage, ttl=30.0):
+        self.storage = storage
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._index = None
+
+    def invalidate(self):
+        self._index = None
+
+    def _current(self):
+        version = self.storage.table_version('users')
+        idx = self._index
+        if idx is not None and idx['version'] == version and time.monotonic() < idx['expires']:
+            return idx
+        with self._lock:
+            idx = self._index
+            if idx is not None and idx['version'] == version and time.monotonic() < idx['expires']:
+                return idx
+            by_id, by_email, by_token = {}, {}, {}
+            for u in self.storage.all('users'):
+                by_id.setdefault(str(u.get('id')), u)
+                if u.get('email'):
+                    by_email.setdefault(str(u['email']), u)
+                if u.get('api_token'):
+                    by_token.setdefault(token_digest(u['api_token']), u)
+            idx = {'version': version, 'expires': time.monotonic() + self.ttl,
+                   'id': by_id, 'email': by_email, 'token': by_token}
+            self._index = idx
+            return idx
+
+    def by_id(self, user_id):
+        return self._current()['id'].get(str(user_id))
+
+    def by_email(self, email):
+        return self._current()['email'].get(str(email))
+
+    def by_token(self, token):
+        if not token:
+            return None
+        return self._current()['token'].get(token_digest(token))
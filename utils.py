@@ -1,7 +1,9 @@
 import hashlib
-import qrcode
+import json
+import base64
+import io
 import os
-import pandas as pd  # <-- FIXED
+from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 
 OFFENCE_WEIGHTS = {
@@ -19,18 +21,61 @@ def compute_priority(offence_type, age_days=0, suspect_in_custody=False):
     custody_bonus = 30 if suspect_in_custody else 0
     return int(base + age_bonus + custody_bonus)
 
-def make_qr(code, static_folder='static'):
-    qr_dir = os.path.join(static_folder, 'qrcodes')
-    os.makedirs(qr_dir, exist_ok=True)
-    path = os.path.join(qr_dir, f"{code}.png")
-    img = qrcode.make(code)
-    img.save(path)
-    return os.path.relpath(path, static_folder)
+def compute_priorities(cases, now=None):
+    # compute_priority over a whole cases frame at once; age is taken from created_at
+    import pandas as pd  # deferred: importing utils should not pull in pandas
+    now = now or datetime.utcnow()
+    offence = cases['offence_type'] if 'offence_type' in cases.columns else pd.Series('', index=cases.index)
+    base = offence.astype(object).map(OFFENCE_WEIGHTS).fillna(OFFENCE_WEIGHTS['other'])
+    # offsets are folded into naive UTC so they compare with utcnow()
+    created = pd.to_datetime(cases['created_at'], errors='coerce', format='ISO8601', utc=True).dt.tz_localize(None) \
+        if 'created_at' in cases.columns else pd.Series(pd.NaT, index=cases.index)
+    age_days = (now - created).dt.days.fillna(0).clip(lower=0)
+    age_bonus = (age_days // 7).clip(upper=50)
+    if 'suspect_in_custody' in cases.columns:
+        in_custody = cases['suspect_in_custody'].astype(str).str.lower().isin(['1', 'true', 'on', 'yes'])
+    else:
+        in_custody = pd.Series(False, index=cases.index)
+    return (base + age_bonus + in_custody * 30).astype(int)
+
+QR_VERSION = 'v1'  # bump when the qrcode rendering parameters change
+
+def qr_digest(code):
+    # the image is a pure function of the code, so the code's hash names the file
+    return hashlib.sha256(f"{QR_VERSION}|{code}".encode('utf-8')).hexdigest()
+
+def render_qr(code):
+    # PNG bytes; module level so it can run in a process pool
+    import qrcode
+    buf = io.BytesIO()
+    qrcode.make(code).save(buf, format='PNG')
+    return buf.getvalue()
+
+def save_qr(path, png):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(png)
+    os.replace(tmp, path)
 
 def compute_event_hash(prev_hash, payload_dict):
     payload = (prev_hash or '') + '|' + '|'.join(f"{k}={v}" for k,v in sorted(payload_dict.items()))
     return hashlib.sha256(payload.encode('utf-8')).hexdigest()
 
+def encode_cursor(key):
+    # key: (-priority_score, created_at, id) of the last row on a page
+    raw = json.dumps(list(key)).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        neg_prio, created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return (int(neg_prio), str(created_at), int(row_id))
+    except (ValueError, TypeError):
+        return None
+
 def hash_password(raw):
     return generate_password_hash(raw)
 